@@ -1,25 +1,55 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from langchain_core.callbacks import AsyncCallbackHandler
 from pydantic import BaseModel
 import pandas as pd
+import plotly.io as pio
+from pandas.api.types import (
+    union_categoricals,
+    is_bool_dtype,
+    is_datetime64_any_dtype,
+    is_float_dtype,
+    is_integer_dtype,
+    is_numeric_dtype,
+    is_object_dtype,
+)
 import asyncio
+import contextlib
+import glob
 import os
-from typing import Dict, Any
+from typing import Dict, Any, List, Tuple
+from dataclasses import dataclass, field
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import uuid
-import io
+import hashlib
+import mmap
 import pickle
 import tempfile
+import threading
 from pathlib import Path
+import lz4.frame
+import orjson
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.feather as feather
+from pyarrow import ArrowException
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
 # Import your existing agent and query analyzer logic
-from src.agent import get_agent
-from src.query_analyzer import analyze_query
+from src.agent import DataScientistAgent
+from src.query_analyzer import analyze_query, get_analyzer
 
-app = FastAPI(title="Data Scientist AI Agent API", version="1.0.0")
+app = FastAPI(
+    title="Data Scientist AI Agent API",
+    version="1.0.0",
+    default_response_class=ORJSONResponse
+)
 
 # Add CORS middleware to allow requests from Streamlit
 # app.add_middleware(
@@ -42,9 +72,45 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress large responses (Plotly JSON compresses very well)
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
 # Persistent session storage
 SESSION_STORAGE_DIR = Path("session_storage")
 SESSION_STORAGE_DIR.mkdir(exist_ok=True)
+# Session data file formats, in order of preference
+FEATHER_SUFFIX = ".feather"
+PICKLE_SUFFIX = ".pkl.lz4"
+LEGACY_PICKLE_SUFFIX = ".pkl"
+SESSION_SUFFIXES = (FEATHER_SUFFIX, PICKLE_SUFFIX, LEGACY_PICKLE_SUFFIX)
+BUFFERS_SUFFIX = ".buf"
+# session_id -> suffix of its data file, kept in sync with the directory so lookups need no stat calls
+KNOWN_SESSIONS: Dict[str, str] = {}
+
+PICKLE_BUFFER_SIZE = 1024 * 1024
+PICKLE_BUFFER_ALIGNMENT = 64
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+ALLOWED_UPLOAD_EXTENSIONS = frozenset({'.csv', '.xlsx', '.xls'})
+
+# CSV ingestion: schema is sniffed from the first rows, then the file is read in chunks
+CSV_SAMPLE_ROWS = 100_000
+CSV_CHUNK_ROWS = 200_000
+CATEGORY_MAX_RATIO = 0.5
+DOWNCAST_MIN_ROWS = 10_000
+# pandas' default missing-value markers, so pyarrow reads large CSVs with the same nulls as pd.read_csv
+CSV_NULL_VALUES = [
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND",
+    "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+]
+# Store string columns with the pyarrow backend (set ARROW_STRINGS=0 to keep object dtype)
+ARROW_STRINGS = os.getenv("ARROW_STRINGS", "1") == "1"
+ARROW_STRING_TYPES = {
+    pa.string(): pd.StringDtype("pyarrow"),
+    pa.large_string(): pd.StringDtype("pyarrow"),
+}
+
+# Memory budget for the in-memory session cache (sessions over budget are evicted, not lost)
+MAX_CACHE_BYTES = int(os.getenv("MAX_CACHE_BYTES", str(1024 ** 3)))
 
 @app.on_event("startup")
 async def startup_event():
@@ -52,75 +118,532 @@ async def startup_event():
     api_key = os.getenv("GOOGLE_API_KEY")
     if api_key:
         print("✅ Google API key loaded successfully")
+        # Build the intent classifier now, and its example centroids in the background, so the
+        # first query doesn't pay for them
+        get_analyzer().prepare_in_background()
     else:
         print("❌ Warning: GOOGLE_API_KEY not found in environment variables")
     
-    # Load existing sessions from disk
-    session_files = list(SESSION_STORAGE_DIR.glob("*.pkl"))
-    if session_files:
-        print(f"🔄 Found {len(session_files)} existing sessions on disk")
-        for session_file in session_files:
-            session_id = session_file.stem
-            df = load_session_from_disk(session_id)
+    # Load existing sessions from disk (legacy .pkl files are still picked up)
+    scan_session_storage()
+    session_ids = list(KNOWN_SESSIONS)
+    if session_ids:
+        print(f"🔄 Found {len(session_ids)} existing sessions on disk")
+        # Dedicated pool sized to the number of sessions so reads and unpickling overlap
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(max_workers=min(32, len(session_ids))) as executor:
+            dfs = await asyncio.gather(
+                *(loop.run_in_executor(executor, load_session_from_disk, session_id) for session_id in session_ids)
+            )
+        for session_id, df in zip(session_ids, dfs):
             if df is not None:
-                DF_STORAGE[session_id] = df
+                cache_session(session_id, df)
                 print(f"📂 Loaded session {session_id} with shape {df.shape}")
     else:
         print("📂 No existing sessions found on disk")
 
-# In-memory cache for active sessions (for performance)
-DF_STORAGE: Dict[str, pd.DataFrame] = {}
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Flush sessions that have not been written to disk yet."""
+    for session_id in list(DIRTY_SESSIONS):
+        await asyncio.to_thread(flush_session, session_id)
+
+# In-memory LRU cache for active sessions (for performance)
+DF_STORAGE: "OrderedDict[str, pd.DataFrame]" = OrderedDict()
+DF_SIZES: Dict[str, int] = {}
+# Cached sessions that have not been written to disk yet (write-back)
+DIRTY_SESSIONS: set = set()
+# Dirty sessions evicted from the cache, kept reachable until their disk write finishes
+FLUSHING_SESSIONS: Dict[str, pd.DataFrame] = {}
+# One agent per cached session, so tools and the ReAct prompt are built once per session
+AGENT_CACHE: Dict[str, DataScientistAgent] = {}
+# Content hash of each session's uploaded file, so agents key their response caches without hashing the DataFrame
+DATA_KEYS: Dict[str, str] = {}
+# Disk I/O runs in worker threads, so cache mutations are serialized
+CACHE_LOCK = threading.Lock()
+# Writes and deletes of one session's files are serialized (striped, so the lock set stays bounded);
+# writers re-check under it that the session wasn't cleared, so a clear can't be undone by a flush
+SESSION_DISK_LOCKS = [threading.Lock() for _ in range(64)]
+
+def _session_disk_lock(session_id: str) -> threading.Lock:
+    """Get the lock that serializes disk writes and deletes for a session."""
+    return SESSION_DISK_LOCKS[hash(session_id) % len(SESSION_DISK_LOCKS)]
+# Prebuilt /health and /debug/sessions bodies, refreshed whenever the cache changes
+HEALTH_SNAPSHOT: Dict[str, Any] = {"status": "healthy", "active_sessions": 0}
+SESSIONS_SNAPSHOT: Dict[str, Any] = {"active_sessions": [], "count": 0}
+
+def _refresh_session_snapshots():
+    """Rebuild the cached session snapshots; call with CACHE_LOCK held."""
+    global HEALTH_SNAPSHOT, SESSIONS_SNAPSHOT
+    active_sessions = list(DF_STORAGE)
+    HEALTH_SNAPSHOT = {"status": "healthy", "active_sessions": len(active_sessions)}
+    SESSIONS_SNAPSHOT = {"active_sessions": active_sessions, "count": len(active_sessions)}
+
+def cache_session(session_id: str, df: pd.DataFrame, dirty: bool = False):
+    """Add a session to the memory cache, evicting least-recently-used sessions over budget.
+
+    Evicted sessions are flushed to disk if they are dirty, so they are
+    reloaded transparently by get_or_load_session; until the write finishes
+    they are served from FLUSHING_SESSIONS.
+    """
+    df_bytes = int(df.memory_usage(deep=True).sum())
+    evicted = []
+    with CACHE_LOCK:
+        DF_STORAGE[session_id] = df
+        DF_STORAGE.move_to_end(session_id)
+        DF_SIZES[session_id] = df_bytes
+        if dirty:
+            DIRTY_SESSIONS.add(session_id)
+
+        cache_bytes = sum(DF_SIZES.values())
+        while cache_bytes > MAX_CACHE_BYTES and len(DF_STORAGE) > 1:
+            evicted_id, evicted_df = DF_STORAGE.popitem(last=False)
+            cache_bytes -= DF_SIZES.pop(evicted_id)
+            AGENT_CACHE.pop(evicted_id, None)
+            if evicted_id in DIRTY_SESSIONS:
+                DIRTY_SESSIONS.discard(evicted_id)
+                FLUSHING_SESSIONS[evicted_id] = evicted_df
+                evicted.append((evicted_id, evicted_df))
+            print(f"♻️ Session {evicted_id} evicted from memory cache")
+        _refresh_session_snapshots()
+
+    for evicted_id, evicted_df in evicted:
+        with _session_disk_lock(evicted_id):
+            # Skipped if the session was cleared while waiting
+            with CACHE_LOCK:
+                pending = FLUSHING_SESSIONS.get(evicted_id) is evicted_df
+            if pending:
+                save_session_to_disk(evicted_id, evicted_df)
+            with CACHE_LOCK:
+                if FLUSHING_SESSIONS.get(evicted_id) is evicted_df:
+                    del FLUSHING_SESSIONS[evicted_id]
+
+def uncache_session(session_id: str):
+    """Remove a session from the memory cache, discarding any pending write."""
+    with CACHE_LOCK:
+        DF_STORAGE.pop(session_id, None)
+        DF_SIZES.pop(session_id, None)
+        DIRTY_SESSIONS.discard(session_id)
+        FLUSHING_SESSIONS.pop(session_id, None)
+        AGENT_CACHE.pop(session_id, None)
+        _refresh_session_snapshots()
+
+def get_session_agent(session_id: str, df: pd.DataFrame) -> DataScientistAgent:
+    """Get the cached agent for a session, creating it on first use."""
+    agent = AGENT_CACHE.get(session_id)
+    data_key = DATA_KEYS.get(session_id)
+    if agent is None:
+        agent = AGENT_CACHE[session_id] = DataScientistAgent(df, data_key=data_key)
+    elif agent.df is not df:
+        # The session was re-uploaded or reloaded from disk
+        agent.update_dataframe(df, data_key=data_key)
+    return agent
+
+def flush_session(session_id: str):
+    """Write a dirty session to disk; a no-op if it was already flushed or cleared."""
+    with _session_disk_lock(session_id):
+        with CACHE_LOCK:
+            df = DF_STORAGE.get(session_id) if session_id in DIRTY_SESSIONS else None
+        if df is None:
+            return
+
+        save_session_to_disk(session_id, df)
+        with CACHE_LOCK:
+            if DF_STORAGE.get(session_id) is df:
+                DIRTY_SESSIONS.discard(session_id)
+
+def scan_session_storage():
+    """Index the session files on disk with a single directory scan."""
+    KNOWN_SESSIONS.clear()
+    with os.scandir(SESSION_STORAGE_DIR) as entries:
+        for entry in entries:
+            for suffix in SESSION_SUFFIXES:
+                if entry.name.endswith(suffix):
+                    session_id = entry.name[:-len(suffix)]
+                    known = KNOWN_SESSIONS.get(session_id)
+                    if known is None or SESSION_SUFFIXES.index(suffix) < SESSION_SUFFIXES.index(known):
+                        KNOWN_SESSIONS[session_id] = suffix
+                    break
+
+def _session_file(session_id: str, suffix: str) -> Path:
+    """Return the path of a session file with the given suffix."""
+    return SESSION_STORAGE_DIR / f"{session_id}{suffix}"
+
+def _remove_session_files(session_id: str, suffix: str):
+    """Delete the file(s) written for a session in the given format."""
+    _session_file(session_id, suffix).unlink(missing_ok=True)
+    if suffix == PICKLE_SUFFIX:
+        _remove_pickle_buffers(session_id)
+
+def _remove_pickle_buffers(session_id: str, keep: str = None):
+    """Delete a session's pickle buffer files, except the one named keep."""
+    for path in SESSION_STORAGE_DIR.glob(f"{glob.escape(session_id)}.*{BUFFERS_SUFFIX}"):
+        if path.name != keep:
+            path.unlink(missing_ok=True)
+
+@contextlib.contextmanager
+def _replacing(path: Path):
+    """Yield a temp path next to path that is renamed over it once written.
+
+    Readers see either the old file or the complete new one, never a partial write.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    os.close(fd)
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+
+def _write_pickle_buffers(path: Path, buffers):
+    """Write out-of-band pickle buffers to a file laid out for memory mapping.
+
+    Layout: 8-byte header length, pickled list of buffer sizes, then each raw
+    buffer aligned to PICKLE_BUFFER_ALIGNMENT bytes.
+    """
+    raws = [buffer.raw() for buffer in buffers]
+    header = pickle.dumps([raw.nbytes for raw in raws])
+    with _replacing(path) as tmp_path, open(tmp_path, 'wb', buffering=PICKLE_BUFFER_SIZE) as f:
+        f.write(len(header).to_bytes(8, 'little'))
+        f.write(header)
+        for raw in raws:
+            f.write(b'\0' * (-f.tell() % PICKLE_BUFFER_ALIGNMENT))
+            f.write(raw)
+
+def _map_pickle_buffers(path: Path):
+    """Memory-map buffers written by _write_pickle_buffers.
+
+    The mapping is copy-on-write, so arrays stay writable and pages are only
+    read from disk when a column is touched. On Windows, where a mapped file
+    cannot be deleted, the buffers are read into memory instead.
+    """
+    with open(path, 'rb') as f:
+        if os.name == 'nt':
+            view = memoryview(bytearray(f.read()))
+        else:
+            view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY))
+    header_len = int.from_bytes(view[:8], 'little')
+    sizes = pickle.loads(view[8:8 + header_len])
+    offset = 8 + header_len
+    buffers = []
+    for size in sizes:
+        offset += -offset % PICKLE_BUFFER_ALIGNMENT
+        buffers.append(view[offset:offset + size])
+        offset += size
+    return buffers
 
 def save_session_to_disk(session_id: str, df: pd.DataFrame):
-    """Save session data to disk for persistence."""
+    """Save session data to disk for persistence.
+
+    DataFrames are written as LZ4-compressed Feather (Arrow IPC). Frames that
+    Arrow cannot represent (e.g. non-string column labels or mixed-type object
+    columns) fall back to an LZ4-compressed pickle whose array buffers are
+    stored out-of-band in a separate, memory-mappable file. Each save writes a
+    new, uniquely named buffer file that the pickle names in a header, so
+    replacing the pickle switches both files at once.
+    """
     try:
-        session_file = SESSION_STORAGE_DIR / f"{session_id}.pkl"
-        with open(session_file, 'wb') as f:
-            pickle.dump(df, f)
+        try:
+            with _replacing(_session_file(session_id, FEATHER_SUFFIX)) as tmp_path:
+                feather.write_feather(df, tmp_path, compression="lz4")
+            suffix = FEATHER_SUFFIX
+        except (ValueError, TypeError, ArrowException):
+            _session_file(session_id, FEATHER_SUFFIX).unlink(missing_ok=True)
+            buffers = []
+            buffers_name = f"{session_id}.{uuid.uuid4().hex[:12]}{BUFFERS_SUFFIX}"
+            with _replacing(_session_file(session_id, PICKLE_SUFFIX)) as tmp_path:
+                with open(tmp_path, 'wb', buffering=PICKLE_BUFFER_SIZE) as raw, \
+                        lz4.frame.open(raw, 'wb', compression_level=1) as f:
+                    pickle.dump({"buffers": buffers_name}, f, protocol=5)
+                    pickle.dump(df, f, protocol=5, buffer_callback=buffers.append)
+                # The buffer file is complete before the pickle that names it goes into place
+                if buffers:
+                    _write_pickle_buffers(SESSION_STORAGE_DIR / buffers_name, buffers)
+            # Buffer files of earlier saves are no longer referenced
+            _remove_pickle_buffers(session_id, keep=buffers_name)
+            suffix = PICKLE_SUFFIX
+        
+        # Drop the file from a previous save in a different format
+        previous = KNOWN_SESSIONS.get(session_id)
+        if previous is not None and previous != suffix:
+            _remove_session_files(session_id, previous)
+        KNOWN_SESSIONS[session_id] = suffix
         print(f"💾 Session {session_id} saved to disk")
     except Exception as e:
         print(f"❌ Failed to save session {session_id} to disk: {e}")
 
 def load_session_from_disk(session_id: str) -> pd.DataFrame:
     """Load session data from disk."""
+    suffix = KNOWN_SESSIONS.get(session_id)
+    if suffix is None:
+        return None
+    
+    session_file = _session_file(session_id, suffix)
     try:
-        session_file = SESSION_STORAGE_DIR / f"{session_id}.pkl"
-        if session_file.exists():
-            with open(session_file, 'rb') as f:
+        if suffix == FEATHER_SUFFIX:
+            table = feather.read_table(session_file)
+            # Restore the saved dtypes from the pandas metadata (object stays object);
+            # string columns are only ever saved with the pyarrow backend
+            with pd.option_context("mode.string_storage", "pyarrow"):
+                df = table.to_pandas(split_blocks=True, self_destruct=True, use_threads=True)
+            del table
+        elif suffix == PICKLE_SUFFIX:
+            with open(session_file, 'rb', buffering=PICKLE_BUFFER_SIZE) as raw, \
+                    lz4.frame.open(raw, 'rb') as f:
+                header = pickle.load(f)
+                try:
+                    buffers = _map_pickle_buffers(SESSION_STORAGE_DIR / header["buffers"])
+                except FileNotFoundError:
+                    # The frame had no out-of-band buffers
+                    buffers = None
+                df = pickle.load(f, buffers=buffers)
+        else:
+            with open(session_file, 'rb', buffering=PICKLE_BUFFER_SIZE) as f:
                 df = pickle.load(f)
-            print(f"📂 Session {session_id} loaded from disk")
-            return df
+        print(f"📂 Session {session_id} loaded from disk")
+        return df
     except Exception as e:
         print(f"❌ Failed to load session {session_id} from disk: {e}")
     return None
 
 def delete_session_from_disk(session_id: str):
-    """Delete session data from disk."""
-    try:
-        session_file = SESSION_STORAGE_DIR / f"{session_id}.pkl"
-        if session_file.exists():
-            session_file.unlink()
+    """Delete session data from disk.
+
+    Call after uncache_session: a write already in progress finishes first and
+    is then deleted, and writes that haven't started see the session is gone.
+    """
+    with _session_disk_lock(session_id):
+        suffix = KNOWN_SESSIONS.pop(session_id, None)
+        if suffix is None:
+            return
+        
+        try:
+            _remove_session_files(session_id, suffix)
             print(f"🗑️ Session {session_id} deleted from disk")
-    except Exception as e:
-        print(f"❌ Failed to delete session {session_id} from disk: {e}")
+        except Exception as e:
+            print(f"❌ Failed to delete session {session_id} from disk: {e}")
 
 def get_or_load_session(session_id: str) -> pd.DataFrame:
     """Get session from memory cache or load from disk."""
-    if session_id in DF_STORAGE:
-        return DF_STORAGE[session_id]
+    with CACHE_LOCK:
+        if session_id in DF_STORAGE:
+            DF_STORAGE.move_to_end(session_id)
+            return DF_STORAGE[session_id]
+        # Evicted but still being written; re-cache it as dirty rather than read a partial file
+        df = FLUSHING_SESSIONS.get(session_id)
+    if df is not None:
+        cache_session(session_id, df, dirty=True)
+        return df
     
     # Try to load from disk
     df = load_session_from_disk(session_id)
     if df is not None:
-        DF_STORAGE[session_id] = df
+        cache_session(session_id, df)
         return df
     
     return None
 
+def optimize_dtypes(df: pd.DataFrame, category_columns=None) -> pd.DataFrame:
+    """Downcast numeric columns and store low-cardinality string columns as categoricals."""
+    # Bin columns by dtype in a single pass instead of one select_dtypes call per group
+    integer_columns, float_columns, object_columns = [], [], []
+    for col, dtype in df.dtypes.items():
+        if is_integer_dtype(dtype):
+            integer_columns.append(col)
+        elif is_float_dtype(dtype):
+            float_columns.append(col)
+        elif is_object_dtype(dtype):
+            object_columns.append(col)
+    
+    for col in integer_columns:
+        df[col] = pd.to_numeric(df[col], downcast='integer')
+    
+    for col in float_columns:
+        downcast = pd.to_numeric(df[col], downcast='float')
+        # Only keep float32 when it round-trips exactly, so analysis results don't change
+        if downcast.dtype != df[col].dtype and downcast.astype(df[col].dtype).equals(df[col]):
+            df[col] = downcast
+    
+    if category_columns is None:
+        category_columns = [
+            col for col in object_columns
+            if df[col].nunique() < CATEGORY_MAX_RATIO * len(df)
+        ]
+    for col in category_columns:
+        df[col] = df[col].astype('category')
+    
+    if ARROW_STRINGS:
+        # Remaining string columns become contiguous Arrow buffers instead of Python objects
+        category_set = set(category_columns)
+        for col in object_columns:
+            if col not in category_set:
+                df[col] = df[col].astype('string[pyarrow]')
+    return df
+
+def spool_upload(src, dst) -> str:
+    """Copy an upload to a file in chunks, returning a content hash computed along the way."""
+    digest = hashlib.blake2b(digest_size=16)
+    while chunk := src.read(UPLOAD_CHUNK_SIZE):
+        digest.update(chunk)
+        dst.write(chunk)
+    return digest.hexdigest()
+
+def read_csv_typed(path: str) -> pd.DataFrame:
+    """Read a CSV in typed chunks using a schema sniffed from the first rows."""
+    sample = pd.read_csv(path, nrows=CSV_SAMPLE_ROWS, memory_map=True)
+    if len(sample) < CSV_SAMPLE_ROWS:
+        # The whole file fits in the sample; small frames aren't worth converting
+        return optimize_dtypes(sample) if len(sample) >= DOWNCAST_MIN_ROWS else sample
+    
+    category_columns = [
+        col for col in sample.select_dtypes(include=['object']).columns
+        if sample[col].nunique() < CATEGORY_MAX_RATIO * len(sample)
+    ]
+    # Keep text columns as text (pyarrow would otherwise infer dates) and dictionary-encode categories
+    column_types = {
+        col: pa.dictionary(pa.int32(), pa.string()) if col in category_columns else pa.string()
+        for col, dtype in sample.dtypes.items() if is_object_dtype(dtype)
+    }
+    columns = list(sample.columns)
+    del sample
+    
+    try:
+        return read_csv_arrow(path, columns, column_types)
+    except ArrowException as e:
+        # e.g. a numeric column with text further down than the inferred block
+        print(f"⚠️ Arrow CSV read failed, falling back to chunked pandas read: {str(e)}")
+        return read_csv_chunked(path, category_columns)
+
+def read_csv_arrow(path: str, columns: List[str], column_types: Dict[str, pa.DataType]) -> pd.DataFrame:
+    """Read a CSV with pyarrow's multithreaded parser, using column types sniffed by pandas."""
+    convert_options = pa_csv.ConvertOptions(
+        column_types=column_types,
+        null_values=CSV_NULL_VALUES,
+        strings_can_be_null=True,
+        quoted_strings_can_be_null=True
+    )
+    table = pa_csv.read_csv(path, convert_options=convert_options)
+    if table.column_names != columns:
+        # pandas renames duplicate headers; keep its naming rather than diverge
+        raise pa.ArrowInvalid("CSV header differs from the pandas sample")
+    df = table.to_pandas(
+        split_blocks=True,
+        self_destruct=True,
+        types_mapper=ARROW_STRING_TYPES.get if ARROW_STRINGS else None
+    )
+    del table
+    # Category columns already arrive dictionary-encoded; don't re-derive them from the full frame
+    return optimize_dtypes(df, category_columns=[])
+
+def read_csv_chunked(path: str, category_columns: List[str]) -> pd.DataFrame:
+    """Read a CSV in pandas chunks, aligning categorical columns across chunks."""
+    chunks = [
+        optimize_dtypes(chunk, category_columns)
+        for chunk in pd.read_csv(
+            path,
+            chunksize=CSV_CHUNK_ROWS,
+            dtype={col: 'category' for col in category_columns},
+            memory_map=True
+        )
+    ]
+    
+    # Align categories across chunks so concat keeps the categorical dtype
+    for col in category_columns:
+        categories = union_categoricals([chunk[col] for chunk in chunks]).categories
+        for chunk in chunks:
+            chunk[col] = chunk[col].cat.set_categories(categories)
+    
+    return pd.concat(chunks, ignore_index=True)
+
+def read_excel_typed(path: str) -> pd.DataFrame:
+    """Read an Excel file, downcasting its dtypes when it is large enough to matter."""
+    # calamine (Rust) reads both .xlsx and .xls and is much faster than openpyxl/xlrd
+    df = pd.read_excel(path, engine="calamine")
+    return optimize_dtypes(df) if len(df) >= DOWNCAST_MIN_ROWS else df
+
+@dataclass
+class SessionMeta:
+    """Column metadata for a session, computed once per upload."""
+    shape: Tuple[int, int]
+    columns: List[str]
+    dtypes: Dict[str, str]
+    numeric_columns: List[str]
+    categorical_columns: List[str]
+    datetime_columns: List[str]
+    etag: str
+    # Response body shared by /upload/ and /data_info, prebuilt so requests do no copying
+    data_info: Dict[str, Any] = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.data_info = {
+            "shape": self.shape,
+            "columns": self.columns,
+            "dtypes": self.dtypes,
+            "numeric_columns": self.numeric_columns,
+            "categorical_columns": self.categorical_columns,
+            "datetime_columns": self.datetime_columns
+        }
+
+# Column metadata per session, computed once at upload (or first request after a reload)
+META_STORAGE: Dict[str, SessionMeta] = {}
+
+def build_session_meta(df: pd.DataFrame) -> SessionMeta:
+    """Describe the shape, columns and column types of a DataFrame, with an ETag for client caching."""
+    # Bin columns by dtype in a single pass instead of one select_dtypes call per group
+    dtypes = {}
+    numeric_columns, categorical_columns, datetime_columns = [], [], []
+    for col, dtype in zip(df.columns, df.dtypes):
+        dtypes[col] = str(dtype)
+        if is_numeric_dtype(dtype) and not is_bool_dtype(dtype):
+            numeric_columns.append(col)
+        elif is_object_dtype(dtype) or isinstance(dtype, (pd.CategoricalDtype, pd.StringDtype)):
+            categorical_columns.append(col)
+        elif is_datetime64_any_dtype(dtype):
+            datetime_columns.append(col)
+    
+    columns = df.columns.tolist()
+    fingerprint = repr((df.shape, tuple(columns), tuple(dtypes.values())))
+    etag = hashlib.blake2b(fingerprint.encode(), digest_size=8).hexdigest()
+    
+    return SessionMeta(
+        shape=df.shape,
+        columns=columns,
+        dtypes=dtypes,
+        numeric_columns=numeric_columns,
+        categorical_columns=categorical_columns,
+        datetime_columns=datetime_columns,
+        etag=f'"{etag}"'
+    )
+
+class AgentStepQueue(AsyncCallbackHandler):
+    """Puts a 'step' event on a queue for each tool call the agent makes."""
+
+    def __init__(self, queue: asyncio.Queue):
+        self.queue = queue
+
+    async def on_agent_action(self, action, **kwargs):
+        await self.queue.put({"event": "step", "tool": action.tool, "tool_input": str(action.tool_input)})
+
+def build_query_response(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Turn an agent result into the /process_query/ response body, with the figure as JSON."""
+    chart_json = result.pop("chart_figure_json", None)
+    chart_figure = result.pop("chart_figure", None)
+    # The agent normally serializes the figure already (cache hits only carry the JSON);
+    # fall back to the orjson engine
+    if chart_json is None and chart_figure:
+        chart_json = pio.to_json(chart_figure, engine="orjson", validate=False)
+    result["visualization_json"] = chart_json
+    result["visualization_generated"] = chart_json is not None
+    return result
+
 class QueryRequest(BaseModel):
     query: str
     session_id: str
 
+class StreamQueryRequest(QueryRequest):
+    analyze: bool = False  # Classify the intent alongside the agent run, in the same stream
+
 class QueryAnalysisRequest(BaseModel):
     query: str
 
@@ -132,58 +655,61 @@ async def root():
 @app.get("/health")
 async def health_check():
     """Health check endpoint."""
-    return {"status": "healthy", "active_sessions": len(DF_STORAGE)}
+    return HEALTH_SNAPSHOT
 
 @app.get("/debug/sessions")
 async def debug_sessions():
     """Debug endpoint to see active sessions."""
-    return {"active_sessions": list(DF_STORAGE.keys()), "count": len(DF_STORAGE)}
+    return SESSIONS_SNAPSHOT
 
 @app.post("/upload/")
-async def upload_data(session_id: str, file: UploadFile = File(...)):
+async def upload_data(session_id: str, background_tasks: BackgroundTasks, file: UploadFile = File(...)):
     """Handles uploading a data file and loading it into a DataFrame."""
     print(f"📁 Upload request for session: {session_id}")
     
-    if not file.filename.endswith(('.csv', '.xlsx', '.xls')):
+    ext = os.path.splitext(file.filename or "")[1].lower()
+    if ext not in ALLOWED_UPLOAD_EXTENSIONS:
         raise HTTPException(status_code=400, detail="Invalid file type. Please upload a CSV or Excel file.")
 
+    tmp_path = None
     try:
-        # Read the file content
-        file_content = await file.read()
+        # Spool the upload to a temp file instead of reading it into memory
+        # (blocking file and parsing work runs off the event loop)
+        with tempfile.NamedTemporaryFile(delete=False, suffix=ext) as tmp:
+            tmp_path = tmp.name
+            data_key = await asyncio.to_thread(spool_upload, file.file, tmp)
         
         # Read the file into a pandas DataFrame
-        if file.filename.endswith('.csv'):
-            df = pd.read_csv(io.BytesIO(file_content))
+        if ext == '.csv':
+            df = await asyncio.to_thread(read_csv_typed, tmp_path)
         else:
-            df = pd.read_excel(io.BytesIO(file_content))
+            df = await asyncio.to_thread(read_excel_typed, tmp_path)
 
-        # Store the DataFrame in our in-memory storage
-        DF_STORAGE[session_id] = df
+        # Store the DataFrame in our in-memory storage; re-uploading the same file keeps its data key
+        DATA_KEYS[session_id] = data_key
+        await asyncio.to_thread(cache_session, session_id, df, True)
         
-        # Save to disk for persistence
-        save_session_to_disk(session_id, df)
+        # Persist to disk after the response is sent (write-back)
+        background_tasks.add_task(flush_session, session_id)
         
         print(f"✅ File uploaded successfully for session: {session_id}, shape: {df.shape}")
         print(f"📊 Active sessions: {list(DF_STORAGE.keys())}")
 
-        # Categorize columns for better UX
-        numeric_columns = df.select_dtypes(include=['int64', 'float64']).columns.tolist()
-        categorical_columns = df.select_dtypes(include=['object']).columns.tolist()
-        datetime_columns = df.select_dtypes(include=['datetime64[ns]']).columns.tolist()
+        # Column metadata is computed once per upload and served from cache afterwards
+        meta = build_session_meta(df)
+        META_STORAGE[session_id] = meta
         
         return {
             "status": "success", 
             "filename": file.filename, 
-            "shape": df.shape,
-            "columns": df.columns.tolist(),
-            "dtypes": df.dtypes.astype(str).to_dict(),
-            "numeric_columns": numeric_columns,
-            "categorical_columns": categorical_columns,
-            "datetime_columns": datetime_columns
+            **meta.data_info
         }
     except Exception as e:
         print(f"❌ Upload failed for session {session_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to process file: {str(e)}")
+    finally:
+        if tmp_path:
+            os.unlink(tmp_path)
 
 @app.post("/analyze_query/")
 async def analyze_user_query(request: QueryAnalysisRequest):
@@ -204,7 +730,7 @@ async def process_agent_query(request: QueryRequest):
     print(f"📊 Available sessions in memory: {list(DF_STORAGE.keys())}")
     
     # Try to get session from memory or disk
-    df = get_or_load_session(request.session_id)
+    df = await asyncio.to_thread(get_or_load_session, request.session_id)
     
     if df is None:
         print(f"❌ Session {request.session_id} not found in storage or disk")
@@ -212,50 +738,108 @@ async def process_agent_query(request: QueryRequest):
 
     try:
         print(f"✅ Processing query for session {request.session_id} with data shape: {df.shape}")
-        agent = get_agent(df)
+        agent = get_session_agent(request.session_id, df)
         result = await agent.process_query(request.query)
-
-        # Convert Plotly figures to JSON for client display
-        if result.get("chart_figure"):
-            chart_figure = result.pop("chart_figure")
-            # Convert Plotly figure to JSON (much smaller than HTML)
-            chart_json = chart_figure.to_json()
-            result["visualization_json"] = chart_json
-            result["visualization_generated"] = True
-        else:
-            result["visualization_generated"] = False
-            result["visualization_json"] = None
-
-        return result
+        return build_query_response(result)
     except Exception as e:
         print(f"❌ Query processing failed for session {request.session_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to process query: {str(e)}")
 
+@app.post("/process_query/stream")
+async def stream_agent_query(request: StreamQueryRequest):
+    """Processes a query like /process_query/, streaming the agent's steps as server-sent events.
+
+    Each tool call is sent as a 'step' event; the last event is 'result' (the
+    /process_query/ body) or 'error'. With analyze set, the query's intent is
+    classified while the agent runs and sent first as an 'intent' event (the
+    /analyze_query/ body); an unclear intent ends the stream and stops the agent.
+    """
+    print(f"🔍 Streaming query request for session: {request.session_id}")
+    df = await asyncio.to_thread(get_or_load_session, request.session_id)
+    if df is None:
+        print(f"❌ Session {request.session_id} not found in storage or disk")
+        raise HTTPException(status_code=404, detail="No data found for this session. Please upload a file first.")
+
+    agent = get_session_agent(request.session_id, df)
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def run_agent():
+        try:
+            result = await agent.process_query(request.query, callbacks=[AgentStepQueue(queue)])
+            await queue.put({"event": "result", **build_query_response(result)})
+        except Exception as e:
+            print(f"❌ Query processing failed for session {request.session_id}: {str(e)}")
+            await queue.put({"event": "error", "detail": f"Failed to process query: {str(e)}"})
+
+    async def run_analysis():
+        try:
+            analysis = await analyze_query(request.query)
+            await queue.put({"event": "intent", "intent": analysis.intent, "confidence": analysis.confidence})
+        except Exception as e:
+            # An unknown intent is treated as clear, so the agent's answer still goes out
+            print(f"⚠️ Intent analysis failed for session {request.session_id}: {str(e)}")
+            await queue.put({"event": "intent", "intent": None, "confidence": 0.0})
+
+    async def events():
+        tasks = [asyncio.create_task(run_agent())]
+        if request.analyze:
+            tasks.append(asyncio.create_task(run_analysis()))
+        # Until the intent is known, everything the agent produces is held back
+        held = [] if request.analyze else None
+        try:
+            while True:
+                event = await queue.get()
+                if event["event"] == "intent":
+                    yield b"data: " + orjson.dumps(event) + b"\n\n"
+                    if event["intent"] == "unclear":
+                        break
+                    pending, held = held, None
+                    for event in pending:
+                        yield b"data: " + orjson.dumps(event) + b"\n\n"
+                    if pending and pending[-1]["event"] != "step":
+                        break
+                    continue
+                if held is not None:
+                    held.append(event)
+                    continue
+                yield b"data: " + orjson.dumps(event) + b"\n\n"
+                if event["event"] != "step":
+                    break
+        finally:
+            # The client went away before the answer, or the query was unclear; stop working on it
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
 @app.get("/session/{session_id}/data_info")
-async def get_data_info(session_id: str):
+async def get_data_info(session_id: str, request: Request, response: Response):
     """Get information about the uploaded data for a session."""
-    df = get_or_load_session(session_id)
-    if df is None:
-        raise HTTPException(status_code=404, detail="No data found for this session.")
+    meta = META_STORAGE.get(session_id)
+    if meta is None:
+        df = await asyncio.to_thread(get_or_load_session, session_id)
+        if df is None:
+            raise HTTPException(status_code=404, detail="No data found for this session.")
+        meta = META_STORAGE[session_id] = build_session_meta(df)
     
-    return {
-        "shape": df.shape,
-        "columns": df.columns.tolist(),
-        "dtypes": df.dtypes.astype(str).to_dict(),
-        "numeric_columns": df.select_dtypes(include=['number']).columns.tolist(),
-        "categorical_columns": df.select_dtypes(include=['object', 'category']).columns.tolist(),
-        "datetime_columns": df.select_dtypes(include=['datetime64']).columns.tolist()
-    }
+    # Let clients that already hold this metadata skip the body entirely
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and meta.etag in (tag.strip() for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers={"ETag": meta.etag})
+    
+    response.headers["ETag"] = meta.etag
+    return meta.data_info
 
 @app.delete("/session/{session_id}")
 async def clear_session(session_id: str):
     """Clear data for a specific session."""
     # Remove from memory cache
-    if session_id in DF_STORAGE:
-        del DF_STORAGE[session_id]
+    uncache_session(session_id)
+    META_STORAGE.pop(session_id, None)
+    DATA_KEYS.pop(session_id, None)
     
     # Remove from disk
-    delete_session_from_disk(session_id)
+    await asyncio.to_thread(delete_session_from_disk, session_id)
     
     return {"status": "success", "message": f"Session {session_id} cleared"}
 
@@ -1,186 +1,61 @@
 import os
+import asyncio
+import contextlib
+import difflib
+import io
+import re
+import sys
 import tempfile
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from functools import lru_cache
 from typing import Dict, Any, List, Optional
 from pathlib import Path
+from types import CodeType
+import numba as nb
+import numpy as np
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 import plotly.figure_factory as ff
+import plotly.io as pio
+import streamlit as st
 
-from langchain_google_genai import ChatGoogleGenerativeAI
+from rapidfuzz import fuzz, process as rf_process
+from google import genai
+from google.genai import types as genai_types
+from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
 from langchain.tools import Tool
 from langchain.agents import create_react_agent, AgentExecutor
 from langchain.prompts import PromptTemplate
+from langchain_core.agents import AgentAction, AgentFinish
+from langchain_core.callbacks import BaseCallbackHandler
 from langchain_core.tools import BaseTool
 from pydantic import BaseModel, Field
 
-class PythonREPLTool(BaseTool):
-    """A tool for executing Python code in a REPL environment."""
-    name: str = "python_repl"
-    description: str = "Execute Python code and return the result. User has pre-selected relevant columns for analysis."
-    df: Optional[pd.DataFrame] = Field(default=None)
-    current_figure: Optional[object] = Field(default=None)
-    selected_columns: Optional[Dict] = Field(default=None)
+# Response cache: exact (query, data) matches plus near-duplicate queries by embedding similarity
+RESPONSE_CACHE_SIZE = 512
+SEMANTIC_CACHE_THRESHOLD = 0.95
+# Longest a query waits for its embedding before skipping the semantic cache
+EMBEDDING_TIMEOUT = 1.0
+# Embeddings barely separate "sales by month" from "sales by year", so semantic hits must also
+# name the same columns and time grain
+_NON_ALNUM_RE = re.compile(r'[^0-9a-z]+')
+_TIME_GRAINS = {
+    'hour': 'hour', 'hourly': 'hour', 'day': 'day', 'daily': 'day', 'week': 'week', 'weekly': 'week',
+    'month': 'month', 'monthly': 'month', 'quarter': 'quarter', 'quarterly': 'quarter',
+    'year': 'year', 'yearly': 'year', 'annual': 'year', 'annually': 'year',
+}
+EMBEDDING_MODEL = "models/text-embedding-004"
 
-    
-    def _run(self, code: str) -> str:
-        """Execute Python code and return the result."""
-        if self.df is None:
-            return "Error: No data available. Please upload a CSV file first."
-        
-        # Clean the code - remove markdown formatting if present
-        code = code.strip()
-        if code.startswith('```python'):
-            code = code[9:]
-        if code.startswith('```'):
-            code = code[3:]
-        if code.endswith('```'):
-            code = code[:-3]
-        code = code.strip()
-        
-        # Add fuzzy column matching function
-        fuzzy_match_code = """
-def find_best_column_match(target, columns):
-    import difflib
-    # Exact match first
-    if target in columns:
-        return target
-    # Case insensitive match
-    for col in columns:
-        if target.lower() == col.lower():
-            return col
-    # Fuzzy match
-    matches = difflib.get_close_matches(target.lower(), [c.lower() for c in columns], n=1, cutoff=0.6)
-    if matches:
-        for col in columns:
-            if col.lower() == matches[0]:
-                return col
-    return None
-"""
-        
-        # Initialize persistent variables storage
-        if not hasattr(self, '_persistent_vars'):
-            self._persistent_vars = {}
-        
-        # Create a safe execution environment
-        import streamlit as st
-        import sys
-        from io import StringIO
-        
-        exec_globals = {
-            'df': self.df,
-            'pd': pd,
-            'px': px,
-            'go': go,
-            'ff': ff,
-            'np': __import__('numpy'),
-            'tempfile': tempfile,
-            'Path': Path,
-            'os': os,
-            'difflib': __import__('difflib'),
-            'time': __import__('time'),
-            'st': st
-        }
-        
-        # Inject selected columns context
-        if self.selected_columns:
-            exec_globals.update({
-                'numeric_columns': self.selected_columns.get('numeric', []),
-                'categorical_columns': self.selected_columns.get('categorical', []),
-                'datetime_columns': self.selected_columns.get('datetime', []),
-                'all_selected': self.selected_columns.get('all', [])
-            })
-        
-        # Add persistent variables to globals BEFORE execution
-        exec_globals.update(self._persistent_vars)
-        
-        exec_locals = {}
-        
-        # Capture stdout to get print statements and df.info() output
-        old_stdout = sys.stdout
-        sys.stdout = captured_output = StringIO()
-        
-        try:
-            # First execute the fuzzy matching function
-            exec(fuzzy_match_code, exec_globals, exec_locals)
-            
-            # Then execute the user code
-            exec(code, exec_globals, exec_locals)
-            
-            # Update persistent variables with new ones from this execution
-            for key, value in exec_locals.items():
-                if not key.startswith('_') and key != 'find_best_column_match':
-                    self._persistent_vars[key] = value
-            
-            # Get captured output
-            output = captured_output.getvalue()
-            
-            # Check if Plotly was used for plotting
-            if ('px.' in code or 'go.' in code or 'ff.' in code) and ('fig' in exec_locals or 'figure' in exec_locals):
-                # Get the Plotly figure from locals
-                fig = exec_locals.get('fig') or exec_locals.get('figure')
-                if fig is not None:
-                    # Store figure reference for the agent to return
-                    self.current_figure = fig
-                    result = "Code executed successfully. Interactive visualization created."
-                    if output.strip():
-                        result += f"\n{output}"
-                    return result
-            else:
-                # Return any variables that were created
-                result_vars = {k: v for k, v in exec_locals.items() if not k.startswith('_') and k != 'find_best_column_match'}
-                result = "Code executed successfully."
-                if output.strip():
-                    result += f"\n{output}"
-                if result_vars:
-                    result += f"\nResults: {result_vars}"
-                return result
-                    
-        except Exception as e:
-            return f"Error executing code: {str(e)}"
-        finally:
-            # Always restore stdout
-            sys.stdout = old_stdout
-    
-    async def _arun(self, code: str) -> str:
-        """Async version of _run."""
-        return self._run(code)
+MODEL_NAME = "gemini-2.5-flash-lite"
+PROMPT_CACHE_TTL = 3600
 
-class DataScientistAgent:
-    """Main agent for data analysis and visualization."""
-    
-    def __init__(self, df: Optional[pd.DataFrame] = None, selected_columns: Optional[Dict] = None):
-        """Initialize the agent with a DataFrame and selected columns."""
-        self.df = df
-        self.selected_columns = selected_columns or {}
-        try:
-            self.llm = ChatGoogleGenerativeAI(
-            model="gemini-2.5-flash-lite",
-            temperature=0.1
-        )
-        except Exception as e:
-            print(f"Warning: Could not initialize Google Generative AI: {str(e)}")
-            print("Please set up your GOOGLE_API_KEY environment variable.")
-            raise ValueError("Google API credentials not found. Please set GOOGLE_API_KEY environment variable.")
-        
-        # Create tools
-        self.python_tool = PythonREPLTool(df=df, selected_columns=selected_columns)
-        self.tools = [self.python_tool]
-        
-        # Create the agent
-        self.agent = self._create_agent()
-        self.agent_executor = AgentExecutor(
-            agent=self.agent,
-            tools=self.tools,
-            verbose=True,
-            handle_parsing_errors="Check your output and make sure it conforms!",
-            max_iterations=15,
-            return_intermediate_steps=True
-        )
-    
-    def _create_agent(self):
-        """Create the ReAct agent."""
-        template = """You are an expert-level data scientist AI agent. Your purpose is to collaborate with the user to analyze a pandas DataFrame (loaded as `df`) by writing and executing Python code. You must be precise, efficient, and safe in your execution.
+# Static system instructions; sent once into a Gemini context cache and referenced by name.
+# Written as a PromptTemplate string, so literal braces are doubled
+STATIC_PROMPT_PREFIX = """You are an expert-level data scientist AI agent. Your purpose is to collaborate with the user to analyze a pandas DataFrame (loaded as `df`) by writing and executing Python code. You must be precise, efficient, and safe in your execution.
 
 Your operation is guided by a core workflow and a set of expert guidelines.
 
@@ -241,6 +116,7 @@ These are the specialized rules you must adhere to throughout the workflow. They
 2.  **ANTI-REPETITION:** If you find yourself writing the same code, comment, or `print` statement more than twice, STOP immediately. This indicates a loop.
 3.  **EMERGENCY STOP:** If a loop is detected, break out by immediately using `Final Answer: Loop detected, stopping execution. Please review the request.` This is a critical safety measure.
 4.  **ECONOMY OF CODE:** Use the simplest, most direct code that achieves the goal. Prefer a single line of `px` over a complex `go` object if it suffices.
+5.  **ROW-WISE MATH:** For per-row numeric transforms, prefer `jit_apply(df[numeric_cols], fn)` (where `fn` takes a numpy row) over `df.apply(fn, axis=1)`. It is JIT-compiled with numba.
 
 **C. Code & Environment Rules:**
 1.  **Variable Scope:** Define all variables within the same code block (`Action Input`) where they are used. Do not assume variables from previous actions persist.
@@ -252,6 +128,7 @@ These are the specialized rules you must adhere to throughout the workflow. They
     * **Time Series Forecasting:** If statsmodels is not available, use simple moving averages or linear trend forecasting with pandas and numpy.
 3.  **Strict Formatting:** Always use the exact `Action:`, `Action Input:`, and `Final Answer:` prefixes. The system depends on this format.
     * **CRITICAL:** Never use backticks around tool names. Write `Action: python_repl` NOT `Action: \`python_repl\``
+4.  **Column Helpers:** `df_cols` (the column names) and `df_cols_lower` (the same names lowercased) are predefined. Use `find_best_column_match(term, df_cols)` to resolve a user's term to an actual column name.
 
 **D. Time Series Forecasting Fallbacks:**
 - **Primary:** Use statsmodels ARIMA for sophisticated forecasting
@@ -259,7 +136,10 @@ These are the specialized rules you must adhere to throughout the workflow. They
 - **Fallback 2:** Use simple moving averages and extrapolation
 - **Always:** Create visualizations comparing actual vs forecasted values
 
-Available tools:
+"""
+
+# Per-request part of the ReAct prompt
+REACT_PROMPT_SUFFIX = """Available tools:
 {tools}
 
 Use the following format:
@@ -276,46 +156,629 @@ Final Answer: the final answer to the original input question
 Question: {input}
 {agent_scratchpad}
 """
+
+# Step 1 of the workflow, whitespace-normalized; its output only changes with the DataFrame
+GROUNDING_CODE = 'actual_columns = df.columns.tolist() print(f"Verified Columns: {actual_columns}") print("---") df.info()'
+
+# Gemini won't create a context cache for content under this many tokens (2.5 Flash models)
+PROMPT_CACHE_MIN_TOKENS = 1024
+
+# Shared across agents: the static prompt is the same for every session
+_prompt_cache = {"name": None, "expires_at": 0.0, "disabled": False}
+# Serializes cache creation so concurrent requests don't each create a cache; one lock per
+# event loop, since the test runner runs queries on loops of its own
+_prompt_cache_locks: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Lock]" = weakref.WeakKeyDictionary()
+
+def _prompt_cache_stale() -> bool:
+    """Check whether the static prompt cache needs (re-)creating."""
+    return not _prompt_cache["disabled"] and time.time() >= _prompt_cache["expires_at"] - 60
+
+def get_prompt_cache_name() -> Optional[str]:
+    """Get the Gemini cached-content name for the static prompt, without any network calls.
+
+    Returns None when the cache does not exist yet, has expired or is unavailable,
+    in which case the full prompt is sent with every request.
+    """
+    return None if _prompt_cache_stale() else _prompt_cache["name"]
+
+def _create_prompt_cache():
+    """Create the Gemini context cache for the static prompt (blocking)."""
+    now = time.time()
+    try:
+        client = genai.Client()
+        text = STATIC_PROMPT_PREFIX.format()
+        tokens = client.models.count_tokens(model=MODEL_NAME, contents=text).total_tokens
+        if tokens < PROMPT_CACHE_MIN_TOKENS:
+            # Creation would fail every time; don't retry after each expiry
+            print(f"Static prompt is {tokens} tokens, below the {PROMPT_CACHE_MIN_TOKENS}-token caching minimum; sending the full prompt")
+            _prompt_cache["name"] = None
+            _prompt_cache["disabled"] = True
+            return
+        cache = client.caches.create(
+            model=MODEL_NAME,
+            config=genai_types.CreateCachedContentConfig(
+                contents=[genai_types.Content(role="user", parts=[genai_types.Part(text=text)])],
+                ttl=f"{PROMPT_CACHE_TTL}s"
+            )
+        )
+        _prompt_cache["name"] = cache.name
+    except Exception as e:
+        print(f"Warning: Gemini context caching unavailable, sending the full prompt: {str(e)}")
+        _prompt_cache["name"] = None
+    _prompt_cache["expires_at"] = now + PROMPT_CACHE_TTL
+
+async def refresh_prompt_cache():
+    """Re-create the static prompt cache if it is stale, off the event loop and once at a time."""
+    if not _prompt_cache_stale():
+        return
+    lock = _prompt_cache_locks.setdefault(asyncio.get_running_loop(), asyncio.Lock())
+    async with lock:
+        if _prompt_cache_stale():
+            await asyncio.to_thread(_create_prompt_cache)
+
+# Chat models and embedders are shared by every session's agent, so all sessions reuse one client
+# (and its connection pool) per prompt cache instead of opening their own
+@lru_cache(maxsize=4)
+def get_llm(cached_content: Optional[str] = None) -> ChatGoogleGenerativeAI:
+    """Get the shared chat model, pointing it at the given cached static prompt if there is one."""
+    return ChatGoogleGenerativeAI(
+        model=MODEL_NAME,
+        temperature=0.1,
+        cached_content=cached_content
+    )
+
+@lru_cache(maxsize=1)
+def get_embeddings() -> GoogleGenerativeAIEmbeddings:
+    """Get the shared embedder used by the semantic response cache."""
+    return GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL)
+
+# Lowercased names for recently matched column sets, so repeated lookups skip re-lowering
+COLUMN_LOOKUP_CACHE_SIZE = 16
+_column_lookup_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+# Tool code runs in worker threads, so cache reads and evictions must not interleave
+_column_lookup_lock = threading.Lock()
+
+def _column_lookup(columns) -> tuple:
+    """Get (lowercased names, lowercased name -> first original column) for a set of columns."""
+    key = tuple(columns)
+    with _column_lookup_lock:
+        lookup = _column_lookup_cache.get(key)
+        if lookup is not None:
+            _column_lookup_cache.move_to_end(key)
+            return lookup
+    
+    lowered = [c.lower() for c in key]
+    # Built in reverse so the first column wins when names differ only by case
+    lookup = (lowered, dict(zip(reversed(lowered), reversed(key))))
+    with _column_lookup_lock:
+        _column_lookup_cache[key] = lookup
+        if len(_column_lookup_cache) > COLUMN_LOOKUP_CACHE_SIZE:
+            _column_lookup_cache.popitem(last=False)
+    return lookup
+
+def find_best_column_match(target, columns):
+    """Find the column that best matches target: exact, then case-insensitive, then fuzzy."""
+    # Exact match first
+    if target in columns:
+        return target
+    # Case insensitive match
+    lowered, lower_to_column = _column_lookup(columns)
+    target_lower = target.lower()
+    if target_lower in lower_to_column:
+        return lower_to_column[target_lower]
+    # Fuzzy match (same 0.6 similarity cutoff difflib.get_close_matches used)
+    match = rf_process.extractOne(target_lower, lowered, scorer=fuzz.ratio, score_cutoff=60)
+    if match:
+        return lower_to_column[match[0]]
+    return None
+
+# Optional ```python / ``` fences around agent code; always matches
+_FENCE_RE = re.compile(r'^(?:```(?:python)?)?(.*?)(?:```)?$', re.DOTALL)
+
+# Plotly usage in agent code (px./go./ff. calls)
+_PLOTLY_RE = re.compile(r'\b(?:px|go|ff)\.')
+
+# Helpers injected into the REPL that should not be reported or persisted as user variables
+_EXCLUDED_VARS = frozenset({'find_best_column_match'})
+
+# The agent often re-runs identical snippets across ReAct steps and queries
+USER_CODE_COMPILE_CACHE_SIZE = 256
+_user_code_compile_cache: "OrderedDict[str, CodeType]" = OrderedDict()
+_user_code_compile_lock = threading.Lock()
+
+def _compile_user_code(code: str) -> CodeType:
+    """Compile agent-generated code, reusing the code object for repeated snippets."""
+    with _user_code_compile_lock:
+        code_obj = _user_code_compile_cache.get(code)
+        if code_obj is not None:
+            _user_code_compile_cache.move_to_end(code)
+            return code_obj
+    
+    # Don't inherit this module's future flags; keep asserts, which agent code uses as data checks
+    code_obj = compile(code, "<agent>", "exec", dont_inherit=True, optimize=0)
+    with _user_code_compile_lock:
+        _user_code_compile_cache[code] = code_obj
+        if len(_user_code_compile_cache) > USER_CODE_COMPILE_CACHE_SIZE:
+            _user_code_compile_cache.popitem(last=False)
+    return code_obj
+
+def jit_apply(df, fn, axis=1):
+    """Apply a numeric function to raw rows (or columns), compiled with numba when it can be typed."""
+    try:
+        return df.apply(fn, axis=axis, raw=True, engine="numba")
+    except nb.core.errors.NumbaError:
+        # Functions numba cannot type or compile still run on the regular engine; errors raised
+        # by fn itself propagate as they are
+        return df.apply(fn, axis=axis, raw=True)
+
+# Traces at least this long are sent as float32 when that is lossless; plotly (6+) packs
+# numpy arrays as binary "bdata"
+FIGURE_FLOAT32_MIN_POINTS = 50_000
+
+def _downcast_figure_arrays(fig):
+    """Return fig with large float64 x/y/z arrays that round-trip exactly through float32 halved in size.
+
+    The user's figure is left untouched; a copy is made only when some array can be cast.
+    """
+    casts = []
+    for i, trace in enumerate(fig.data):
+        for attr in ('x', 'y', 'z'):
+            values = getattr(trace, attr, None)
+            if isinstance(values, np.ndarray) and values.dtype == np.float64 and values.size >= FIGURE_FLOAT32_MIN_POINTS:
+                downcast = values.astype(np.float32)
+                if np.array_equal(downcast, values, equal_nan=True):
+                    casts.append((i, attr, downcast))
+    if not casts:
+        return fig
+    fig = go.Figure(fig)
+    for i, attr, downcast in casts:
+        # plotly ignores assigning a value equal to the current one, which an exact cast is
+        fig.data[i][attr] = None
+        fig.data[i][attr] = downcast
+    return fig
+
+class _ThreadLocalStdout:
+    """sys.stdout replacement that sends writes from a capturing thread to that thread's buffer.
+
+    Other threads (and the event loop) keep writing to the stream it wraps, so
+    tool code running concurrently in worker threads only captures its own output.
+    """
+
+    def __init__(self, default):
+        self._default = default
+        self._local = threading.local()
+
+    def _target(self):
+        return getattr(self._local, 'stream', None) or self._default
+
+    def write(self, s):
+        return self._target().write(s)
+
+    def flush(self):
+        return self._target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self._target(), name)
+
+    @contextlib.contextmanager
+    def capture(self, stream):
+        """Send this thread's writes to stream for the duration of the block."""
+        previous = getattr(self._local, 'stream', None)
+        self._local.stream = stream
+        try:
+            yield stream
+        finally:
+            self._local.stream = previous
+
+_STDOUT_INSTALL_LOCK = threading.Lock()
+
+def _capture_stdout(stream):
+    """Capture the current thread's stdout into stream, installing the thread-local router if needed."""
+    with _STDOUT_INSTALL_LOCK:
+        router = sys.stdout
+        if not isinstance(router, _ThreadLocalStdout):
+            router = sys.stdout = _ThreadLocalStdout(router)
+    return router.capture(stream)
+
+# Modules and helpers available to agent code; copied for each run
+_EXEC_GLOBALS_BASE = {
+    'pd': pd,
+    'px': px,
+    'go': go,
+    'ff': ff,
+    'np': np,
+    'tempfile': tempfile,
+    'Path': Path,
+    'os': os,
+    'difflib': difflib,
+    'time': time,
+    'st': st,
+    'nb': nb,
+    'find_best_column_match': find_best_column_match,
+    'jit_apply': jit_apply
+}
+
+class PythonREPLTool(BaseTool):
+    """A tool for executing Python code in a REPL environment."""
+    name: str = "python_repl"
+    description: str = "Execute Python code and return the result. User has pre-selected relevant columns for analysis."
+    df: Optional[pd.DataFrame] = Field(default=None)
+    current_figure: Optional[object] = Field(default=None)
+    current_figure_json: Optional[str] = Field(default=None)
+    selected_columns: Optional[Dict] = Field(default=None)
+    grounding_output: Optional[tuple] = Field(default=None)
+
+    
+    def _run_grounding(self) -> str:
+        """Return the output of the grounding snippet, computing df.info() once per DataFrame layout."""
+        actual_columns = self.df.columns.tolist()
+        # Agent code mutates df in place (new columns, drops, astype), so key on its layout, not identity
+        layout = (self.df.shape, tuple(self.df.columns), tuple(self.df.dtypes))
+        if self.grounding_output is None or self.grounding_output[0] != layout:
+            info_buffer = io.StringIO()
+            self.df.info(buf=info_buffer)
+            self.grounding_output = (layout, f"Verified Columns: {actual_columns}\n---\n{info_buffer.getvalue()}")
+        
+        self._persistent_vars['actual_columns'] = actual_columns
+        return f"Code executed successfully.\n{self.grounding_output[1]}\nResults: {{'actual_columns': {actual_columns}}}"
+    
+    def _run(self, code: str) -> str:
+        """Execute Python code and return the result."""
+        if self.df is None:
+            return "Error: No data available. Please upload a CSV file first."
+        
+        # Clean the code - remove markdown formatting if present
+        code = _FENCE_RE.match(code.strip()).group(1).strip()
+        
+        # Initialize persistent variables storage
+        if not hasattr(self, '_persistent_vars'):
+            self._persistent_vars = {}
+        
+        # Every query starts with the same grounding snippet; skip re-scanning the data for it
+        if " ".join(code.split()) == GROUNDING_CODE:
+            return self._run_grounding()
+        
+        # Create a safe execution environment
+        exec_globals = _EXEC_GLOBALS_BASE.copy()
+        exec_globals['df'] = self.df
+        
+        # Inject selected columns context
+        if self.selected_columns:
+            exec_globals.update({
+                'numeric_columns': self.selected_columns.get('numeric', []),
+                'categorical_columns': self.selected_columns.get('categorical', []),
+                'datetime_columns': self.selected_columns.get('datetime', []),
+                'all_selected': self.selected_columns.get('all', [])
+            })
+        
+        # Add persistent variables to globals BEFORE execution
+        exec_globals.update(self._persistent_vars)
+        
+        exec_locals = {}
+        
+        try:
+            # Column helpers from the live columns, since earlier code may have changed df in place
+            # (the lowercased names come from the column lookup cache)
+            exec_globals['df_cols'] = tuple(self.df.columns)
+            exec_globals['df_cols_lower'] = tuple(_column_lookup(self.df.columns)[0])
+            
+            # Execute the user code, capturing print statements and df.info() output
+            # (only this thread's; other sessions and the server keep their own stdout)
+            with _capture_stdout(io.StringIO()) as stdout_buffer:
+                exec(_compile_user_code(code), exec_globals, exec_locals)
+            
+            # Update persistent variables with new ones from this execution
+            new_vars = {k: v for k, v in exec_locals.items() if k[0] != '_' and k not in _EXCLUDED_VARS}
+            self._persistent_vars.update(new_vars)
+            
+            # Get captured output
+            output = stdout_buffer.getvalue()
+            
+            # Check if Plotly was used for plotting and get the figure from locals
+            if _PLOTLY_RE.search(code) and (fig := exec_locals.get('fig') or exec_locals.get('figure')) is not None:
+                # Store figure reference for the agent to return
+                self.current_figure = fig
+                # Serialize once here so callers and the response cache don't re-walk the figure
+                self.current_figure_json = pio.to_json(_downcast_figure_arrays(fig), engine="orjson", validate=False)
+                result = "Code executed successfully. Interactive visualization created."
+                if output.strip():
+                    result += f"\n{output}"
+                return result
+            else:
+                # Return any variables that were created
+                result = "Code executed successfully."
+                if output.strip():
+                    result += f"\n{output}"
+                if new_vars:
+                    result += f"\nResults: {new_vars}"
+                return result
+                    
+        except Exception as e:
+            return f"Error executing code: {str(e)}"
+    
+    async def _arun(self, code: str) -> str:
+        """Async version of _run; executes in a worker thread so the event loop stays free."""
+        return await asyncio.to_thread(self._run, code)
+
+# Stop the ReAct loop when a tool call repeats one of the previous steps (the prompt's EMERGENCY STOP)
+LOOP_DETECTION_WINDOW = 3
+LOOP_STOP_MESSAGE = "Loop detected, stopping execution. Please review the request."
+
+# Outputs that end the ReAct loop without a Final Answer (loop guard, prompt's EMERGENCY STOP,
+# AgentExecutor iteration/time limits); these are never cached
+_STOPPED_OUTPUT_PREFIXES = ("Loop detected", "Agent stopped due to")
+
+def _is_final_answer(output: str) -> bool:
+    """Check whether an executor output is a real answer rather than a stop message."""
+    return bool(output.strip()) and not output.startswith(_STOPPED_OUTPUT_PREFIXES)
+
+def _action_key(action: AgentAction) -> tuple:
+    """Identify a tool call by tool name and whitespace-normalized input."""
+    return (action.tool, " ".join(str(action.tool_input).split()))
+
+class LoopGuardAgentExecutor(AgentExecutor):
+    """AgentExecutor that finishes early instead of spending iterations on a repeated action."""
+    
+    def _repeats_recent_action(self, intermediate_steps: list, next_step_output) -> bool:
+        """Check whether the step just taken repeats a recent tool call; parsing-error retries don't count."""
+        if isinstance(next_step_output, AgentFinish):
+            return False
+        recent = {
+            _action_key(action)
+            for action, _ in intermediate_steps[-(LOOP_DETECTION_WINDOW - 1):]
+            if action.tool != "_Exception"
+        }
+        return any(action.tool != "_Exception" and _action_key(action) in recent for action, _ in next_step_output)
+    
+    def _take_next_step(self, name_to_tool_map, color_mapping, inputs, intermediate_steps, run_manager=None):
+        next_step_output = super()._take_next_step(name_to_tool_map, color_mapping, inputs, intermediate_steps, run_manager)
+        if self._repeats_recent_action(intermediate_steps, next_step_output):
+            print(f"Warning: {LOOP_STOP_MESSAGE}")
+            return AgentFinish(return_values={"output": LOOP_STOP_MESSAGE}, log=LOOP_STOP_MESSAGE)
+        return next_step_output
+    
+    async def _atake_next_step(self, name_to_tool_map, color_mapping, inputs, intermediate_steps, run_manager=None):
+        next_step_output = await super()._atake_next_step(name_to_tool_map, color_mapping, inputs, intermediate_steps, run_manager)
+        if self._repeats_recent_action(intermediate_steps, next_step_output):
+            print(f"Warning: {LOOP_STOP_MESSAGE}")
+            return AgentFinish(return_values={"output": LOOP_STOP_MESSAGE}, log=LOOP_STOP_MESSAGE)
+        return next_step_output
+
+class DataScientistAgent:
+    """Main agent for data analysis and visualization."""
+    
+    def __init__(self, df: Optional[pd.DataFrame] = None, selected_columns: Optional[Dict] = None,
+                 data_key: Optional[str] = None):
+        """Initialize the agent with a DataFrame and selected columns.
+
+        data_key identifies the data (e.g. per upload); when given, the DataFrame is not hashed.
+        """
+        self.df = df
+        self.selected_columns = selected_columns or {}
+        self._df_fp = self._fingerprint(df, data_key)
+        self._response_cache: "OrderedDict[tuple, dict]" = OrderedDict()
+        self._embeddings = None
+        self._prompt_cache_name = get_prompt_cache_name()
+        try:
+            self.llm = self._create_llm()
+        except Exception as e:
+            print(f"Warning: Could not initialize Google Generative AI: {str(e)}")
+            print("Please set up your GOOGLE_API_KEY environment variable.")
+            raise ValueError("Google API credentials not found. Please set GOOGLE_API_KEY environment variable.")
+        
+        # Create tools
+        self.python_tool = PythonREPLTool(df=df, selected_columns=selected_columns)
+        self.tools = [self.python_tool]
+        
+        # Create the agent
+        self.agent = self._create_agent()
+        self.agent_executor = self._create_executor()
+    
+    def _create_llm(self) -> ChatGoogleGenerativeAI:
+        """Get the chat model for the current cached static prompt."""
+        return get_llm(self._prompt_cache_name)
+    
+    def _create_executor(self) -> AgentExecutor:
+        """Create the executor that runs the ReAct loop."""
+        return LoopGuardAgentExecutor(
+            agent=self.agent,
+            tools=self.tools,
+            verbose=True,
+            handle_parsing_errors="Check your output and make sure it conforms!",
+            max_iterations=15,
+            return_intermediate_steps=True
+        )
+    
+    async def _refresh_prompt_cache(self):
+        """Refresh the shared prompt cache if it is stale, then rebuild the agent if its name changed."""
+        await refresh_prompt_cache()
+        self._use_prompt_cache(get_prompt_cache_name())
+    
+    def _refresh_prompt_cache_sync(self):
+        """Blocking version of _refresh_prompt_cache for the synchronous query path."""
+        if _prompt_cache_stale():
+            _create_prompt_cache()
+        self._use_prompt_cache(get_prompt_cache_name())
+    
+    def _use_prompt_cache(self, cache_name: Optional[str]):
+        """Rebuild the LLM and agent if the shared prompt cache was re-created."""
+        if cache_name != self._prompt_cache_name:
+            self._prompt_cache_name = cache_name
+            self.llm = self._create_llm()
+            self.agent = self._create_agent()
+            self.agent_executor = self._create_executor()
+    
+    def _create_agent(self):
+        """Create the ReAct agent."""
+        if self._prompt_cache_name:
+            # The static instructions are already in the Gemini context cache
+            template = REACT_PROMPT_SUFFIX
+        else:
+            template = STATIC_PROMPT_PREFIX + REACT_PROMPT_SUFFIX
         
         prompt = PromptTemplate.from_template(template)
         return create_react_agent(self.llm, self.tools, prompt)
     
-    def update_dataframe(self, df: pd.DataFrame, selected_columns: Optional[Dict] = None):
+    def update_dataframe(self, df: pd.DataFrame, selected_columns: Optional[Dict] = None,
+                         data_key: Optional[str] = None):
         """Update the DataFrame and selected columns for the agent."""
+        if df is not self.df:
+            self._df_fp = self._fingerprint(df, data_key)
+            self.python_tool.grounding_output = None
         self.df = df
         self.selected_columns = selected_columns or {}
         self.python_tool.df = df
         self.python_tool.selected_columns = selected_columns or {}
     
-    async def process_query(self, query: str) -> dict:
-        """Process a user query and return the result."""
+    @staticmethod
+    def _fingerprint(df: Optional[pd.DataFrame], data_key: Optional[str] = None) -> Optional[tuple]:
+        """Fingerprint the DataFrame so cached responses are tied to the data they came from."""
+        if df is None:
+            return None
+        if data_key is not None:
+            # The caller already knows which data this is; skip hashing every row
+            return (df.shape, tuple(df.columns), data_key)
+        # Row hashes include the index, so the (wrapping) uint64 sum still changes when rows move
+        row_hashes = pd.util.hash_pandas_object(df, index=True).values
+        return (df.shape, tuple(df.columns), int(row_hashes.sum(dtype=np.uint64)))
+    
+    def _cache_key(self, query: str) -> tuple:
+        """Build the exact-match cache key for a query against the current data."""
+        return (self._df_fp, " ".join(query.lower().split()))
+    
+    def _query_signature(self, normalized_query: str) -> tuple:
+        """Get the columns and time grains a query names; semantic cache hits must match it exactly."""
+        words = _NON_ALNUM_RE.sub(' ', normalized_query).split()
+        padded = f" {' '.join(words)} "
+        columns = frozenset(
+            col for col in self.df.columns
+            if (name := _NON_ALNUM_RE.sub(' ', str(col).lower()).strip()) and f" {name} " in padded
+        ) if self.df is not None else frozenset()
+        grains = frozenset(_TIME_GRAINS[w.rstrip('s')] for w in words if w.rstrip('s') in _TIME_GRAINS)
+        return (columns, grains)
+    
+    def _embed_query(self, query: str) -> Optional[np.ndarray]:
+        """Embed a query for the semantic cache; returns None if embeddings are unavailable."""
         try:
-            result = self.agent_executor.invoke({"input": query})
+            if self._embeddings is None:
+                self._embeddings = get_embeddings()
+            vector = np.asarray(self._embeddings.embed_query(query), dtype=np.float32)
+            return vector / np.linalg.norm(vector)
+        except Exception as e:
+            print(f"Warning: Semantic cache unavailable: {str(e)}")
+            return None
+    
+    async def _embed_query_with_timeout(self, query: str) -> Optional[np.ndarray]:
+        """Embed a query off the event loop, giving up after EMBEDDING_TIMEOUT seconds."""
+        try:
+            return await asyncio.wait_for(asyncio.to_thread(self._embed_query, query), EMBEDDING_TIMEOUT)
+        except asyncio.TimeoutError:
+            print("Warning: Query embedding timed out, skipping the semantic cache")
+            return None
+    
+    def _lookup_cached_response(self, key: tuple, embedding: Optional[np.ndarray]) -> Optional[dict]:
+        """Find a cached response by exact key, then by embedding similarity on the same data."""
+        match_key = key if key in self._response_cache else None
+        
+        if match_key is None and embedding is not None:
+            signature = self._query_signature(key[1])
+            candidates = [
+                (cached_key, entry["embedding"])
+                for cached_key, entry in self._response_cache.items()
+                if cached_key[0] == self._df_fp and entry["embedding"] is not None
+                and entry["signature"] == signature
+            ]
+            if candidates:
+                scores = np.stack([vector for _, vector in candidates]) @ embedding
+                best = int(np.argmax(scores))
+                if scores[best] >= SEMANTIC_CACHE_THRESHOLD:
+                    match_key = candidates[best][0]
+        
+        if match_key is None:
+            return None
+        self._response_cache.move_to_end(match_key)
+        return self._response_cache[match_key]
+    
+    def _store_cached_response(self, key: tuple, embedding: Optional[np.ndarray], response: str, figure_json: Optional[str]):
+        """Cache a Final Answer, keeping at most RESPONSE_CACHE_SIZE entries; stop messages are skipped."""
+        if not _is_final_answer(response):
+            return
+        self._response_cache[key] = {
+            "response": response,
+            "figure_json": figure_json,
+            "embedding": embedding,
+            "signature": self._query_signature(key[1])
+        }
+        self._response_cache.move_to_end(key)
+        while len(self._response_cache) > RESPONSE_CACHE_SIZE:
+            self._response_cache.popitem(last=False)
+    
+    async def process_query(self, query: str, callbacks: Optional[List[BaseCallbackHandler]] = None) -> dict:
+        """Process a user query and return the result; callbacks observe the agent's steps."""
+        key = self._cache_key(query)
+        embedding = None
+        if key not in self._response_cache:
+            # Embed while the prompt cache is refreshed, and don't hold up the agent for a slow embedder
+            # (a refresh error resurfaces from the refresh below, where it is reported)
+            embedding, _ = await asyncio.gather(
+                self._embed_query_with_timeout(query), self._refresh_prompt_cache(), return_exceptions=True
+            )
+        cached = self._lookup_cached_response(key, embedding)
+        if cached is not None:
+            # Callers serialize from the JSON, so the figure object is not rebuilt
+            return {
+                "success": True,
+                "response": cached["response"],
+                "chart_figure": None,
+                "chart_figure_json": cached["figure_json"]
+            }
+        
+        try:
+            await self._refresh_prompt_cache()
+            result = await self.agent_executor.ainvoke({"input": query}, config={"callbacks": callbacks})
             
-            # Check if a visualization was created
-            chart_figure = None
-            if hasattr(self.tools[0], 'current_figure'):
-                chart_figure = self.tools[0].current_figure
-                # Return the figure object (DO NOT use fig.show())
-                self.tools[0].current_figure = None
+            # Check if a visualization was created (return the figure object, DO NOT use fig.show())
+            chart_figure = self.python_tool.current_figure
+            chart_figure_json = self.python_tool.current_figure_json
+            self.python_tool.current_figure = None
+            self.python_tool.current_figure_json = None
             
+            self._store_cached_response(key, embedding, result["output"], chart_figure_json)
             return {
                 "success": True,
                 "response": result["output"],
-                "chart_figure": chart_figure
+                "chart_figure": chart_figure,
+                "chart_figure_json": chart_figure_json
             }
         except Exception as e:
             return {
                 "success": False,
                 "error": str(e),
                 "response": f"I encountered an error: {str(e)}",
-                "chart_figure": None
+                "chart_figure": None,
+                "chart_figure_json": None
             }
     
     def process_query_sync(self, query: str) -> Dict[str, Any]:
         """Process a user query synchronously and return the result."""
+        key = self._cache_key(query)
+        embedding = None if key in self._response_cache else self._embed_query(query)
+        cached = self._lookup_cached_response(key, embedding)
+        if cached is not None:
+            return {
+                "success": True,
+                "response": cached["response"],
+                "chart_path": None,
+                "error": None
+            }
+        
         try:
+            self._refresh_prompt_cache_sync()
             result = self.agent_executor.invoke({"input": query})
+            chart_figure_json = self.python_tool.current_figure_json
+            self.python_tool.current_figure = None
+            self.python_tool.current_figure_json = None
+            self._store_cached_response(key, embedding, result.get("output", ""), chart_figure_json)
             
             # Check for generated visualizations
             chart_path = None
@@ -1,18 +1,53 @@
 import streamlit as st
-import streamlit.components.v1 as components
 from dotenv import load_dotenv
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+from requests_toolbelt import MultipartEncoder
+from urllib3.util.retry import Retry
 import uuid
+import queue
+from concurrent.futures import ThreadPoolExecutor
 import json
-import plotly
-import plotly.graph_objects as go
 import re
 
-# Load environment variables
-load_dotenv()
+# Load environment variables once per session (Streamlit re-executes this script on every interaction)
+if not st.session_state.get('_env_loaded'):
+    load_dotenv()
+    st.session_state._env_loaded = True
 
 API_URL = "https://data-scientist-ai-agent.onrender.com/"  # URL of your FastAPI backend
+CHAT_HISTORY_WINDOW = 20  # Messages rendered per rerun; older ones sit behind a "show older" button
+CODE_BLOCK_CACHE_SIZE = 512  # Messages whose code block extraction is kept across reruns
+QUERY_WORKERS = 8  # Concurrent streamed queries across all browser sessions
+UPLOAD_WORKERS = 2  # Concurrent background file uploads across all browser sessions
+UPLOAD_POLL_INTERVAL = 0.5  # Seconds between checks on a background upload
+UPLOAD_ATTEMPTS = 2  # Tries per upload when the connection drops (each re-reads the file)
+VISUALIZATION_CAPTION = "📊 **Interactive visualization generated!**"
+
+# Code block extraction patterns, compiled once rather than on every message render
+CODE_BLOCK_RE = re.compile(r'```(?:python)?\s*\n?(.*?)\n?```', re.DOTALL)
+TRIVIAL_ASSIGN_RE = re.compile(r'^[a-zA-Z_][a-zA-Z0-9_]*\s*$')
+PLOTTING_CODE_RE = re.compile(r'import\s+|px\.|pd\.')
+# Any of these marks a block as substantial code (imports, function calls, plot arguments, ...)
+MEANINGFUL_CODE_RE = re.compile(
+    r'import\s+|def\s+|class\s+|px\.|pd\.|\.\w+\s*\(|=\s*\w+\s*\(|for\s+|if\s+|#'
+    r'|x=|y=|color=|title=|facet_|hover_data'
+)
+# Runs of blank (or whitespace-only) lines left behind once code blocks are cut out
+BLANK_LINES_RE = re.compile(r'\n\s*\n')
+
+# Queries that can't be a data request (only punctuation/digits, or a bare greeting) skip the intent API
+TRIVIALLY_UNCLEAR_RE = re.compile(r"^[\W\d_]*$|^(?:hi|hello|hey|thanks|thank you)\W*$", re.IGNORECASE)
+
+# Quick Analysis sidebar buttons as (label, widget key, text appended to the query)
+QUICK_ANALYSIS_BUTTONS = [
+    ("📊 Basic Stats", "quick_stats", "show basic statistics"),
+    ("🔗 Correlation", "quick_corr", "show correlation matrix"),
+    ("📈 Value Counts", "quick_counts", "show value counts"),
+    ("📊 Histogram", "quick_hist", "create histogram"),
+    ("📈 Scatter Plot", "quick_scatter", "create scatter plot"),
+]
 
 # Set page config
 st.set_page_config(
@@ -30,69 +65,168 @@ if 'df_uploaded' not in st.session_state:
     st.session_state.df_uploaded = False
 if 'data_info' not in st.session_state:
     st.session_state.data_info = None
-if 'chat_input' not in st.session_state:
-    st.session_state.chat_input = ""
+if 'col_cats' not in st.session_state:
+    st.session_state.col_cats = None
+if 'col_picker_spec' not in st.session_state:
+    st.session_state.col_picker_spec = None
+if 'column_info' not in st.session_state:
+    st.session_state.column_info = None
+if 'chat_tokens' not in st.session_state:
+    st.session_state.chat_tokens = []  # Query pieces, joined only when the input box is drawn
 if 'input_key' not in st.session_state:
     st.session_state.input_key = 0
+if 'history_window' not in st.session_state:
+    st.session_state.history_window = CHAT_HISTORY_WINDOW
+if 'upload_future' not in st.session_state:
+    st.session_state.upload_future = None  # Background upload in progress, if any
+if 'upload_file_id' not in st.session_state:
+    st.session_state.upload_file_id = None  # File the last upload was started for
+
+@st.cache_resource
+def get_http_session():
+    """Get the HTTP session shared by all reruns, so keep-alive connections to the API are reused."""
+    session = requests.Session()
+    # Pool sized for concurrent browser sessions; retries cover dropped keep-alive connections
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=Retry(total=2, backoff_factor=0.1))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
 
 def check_api_connection():
     """Check if the FastAPI server is running."""
     try:
-        response = requests.get(f"{API_URL}/health", timeout=5)
+        response = get_http_session().get(f"{API_URL}/health", timeout=5)
         return response.status_code == 200
     except requests.exceptions.RequestException:
         return False
 
+@st.cache_resource
+def get_upload_executor():
+    """Get the worker pool that sends uploaded files to the API in the background."""
+    return ThreadPoolExecutor(max_workers=UPLOAD_WORKERS)
+
+@st.cache_resource
+def get_upload_session():
+    """Get the HTTP session for file uploads, which retries by re-sending the file itself.
+
+    urllib3 retries would re-send the multipart stream after it was already read.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=UPLOAD_WORKERS, max_retries=0)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def post_file(session, session_id, uploaded_file):
+    """Upload file to the FastAPI backend (runs on an upload worker, so no st.* calls)."""
+    for attempt in range(UPLOAD_ATTEMPTS):
+        # The encoder reads the file in chunks as it is sent, rather than copying it into a new buffer
+        # first; it can only be read once, so each attempt gets a fresh one
+        uploaded_file.seek(0)
+        encoder = MultipartEncoder(fields={'file': (uploaded_file.name, uploaded_file, uploaded_file.type)})
+        try:
+            return session.post(
+                f"{API_URL}/upload/?session_id={session_id}", 
+                data=encoder,
+                headers={'Content-Type': encoder.content_type},
+                timeout=30
+            )
+        except requests.exceptions.ConnectionError:
+            if attempt == UPLOAD_ATTEMPTS - 1:
+                raise
+
 def upload_file_to_api(uploaded_file):
-    """Upload file to the FastAPI backend."""
-    files = {'file': (uploaded_file.name, uploaded_file.getvalue(), uploaded_file.type)}
-    try:
-        response = requests.post(
-            f"{API_URL}/upload/?session_id={st.session_state.session_id}", 
-            files=files,
-            timeout=30
-        )
-        return response
-    except requests.exceptions.RequestException as e:
-        st.error(f"Connection error: {str(e)}")
-        return None
+    """Start uploading a file to the FastAPI backend and return the Future of its response."""
+    return get_upload_executor().submit(post_file, get_upload_session(), st.session_state.session_id, uploaded_file)
+
+@st.fragment(run_every=UPLOAD_POLL_INTERVAL)
+def upload_status():
+    """Show that an upload is running; once it is done, rerun the app to handle the response."""
+    if st.session_state.upload_future.done():
+        st.rerun()
+    st.info("⏳ Uploading and processing file...")
 
 def get_data_info():
     """Get data information from the API."""
     try:
-        response = requests.get(f"{API_URL}/session/{st.session_state.session_id}/data_info")
+        response = get_http_session().get(f"{API_URL}/session/{st.session_state.session_id}/data_info")
         if response.status_code == 200:
             return response.json()
         return None
     except requests.exceptions.RequestException:
         return None
 
-def analyze_query_with_api(query):
-    """Analyze query intent using the API."""
-    try:
-        payload = {"query": query}
-        response = requests.post(f"{API_URL}/analyze_query/", json=payload)
-        if response.status_code == 200:
-            return response.json()
-        return None
-    except requests.exceptions.RequestException:
-        return None
+@st.cache_resource
+def get_query_executor():
+    """Get the worker pool that streams queries from the API while the page shows their progress."""
+    return ThreadPoolExecutor(max_workers=QUERY_WORKERS)
 
-def process_query_with_api(query):
-    """Process query using the API."""
+def stream_query(session, payload, events):
+    """Stream a query through /process_query/stream, putting each server-sent event on the events queue.
+
+    Runs on a worker thread, so it must not call st.* functions. Always ends with a
+    'result', 'error' or 'connection_error' event, or with an unclear 'intent' event.
+    """
     try:
-        payload = {"query": query, "session_id": st.session_state.session_id}
-        response = requests.post(f"{API_URL}/process_query/", json=payload, timeout=60)
-        return response
+        with session.post(f"{API_URL}/process_query/stream", json=payload, timeout=60, stream=True) as response:
+            if response.status_code != 200:
+                events.put({"event": "error", "detail": response.text})
+                return
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("data: "):
+                    event = json.loads(line[len("data: "):])
+                    events.put(event)
+                    if event["event"] not in ("step", "intent") or event.get("intent") == "unclear":
+                        return
+        events.put({"event": "error", "detail": "The API closed the stream before answering."})
     except requests.exceptions.RequestException as e:
-        st.error(f"Connection error: {str(e)}")
-        return None
+        events.put({"event": "connection_error", "detail": str(e)})
+
+def analyze_and_process_query(query):
+    """Send a query to the API, which analyzes its intent while processing it; returns (analysis, events).
 
+    events is the queue stream_query fills with the rest of the stream, or None when the intent is unclear.
+    """
+    if TRIVIALLY_UNCLEAR_RE.match(query.strip()):
+        return {"intent": "unclear", "confidence": 1.0}, None
+    
+    # One request does both: the stream opens with the intent, then carries the agent's answer
+    payload = {"query": query, "session_id": st.session_state.session_id, "analyze": True}
+    events = queue.Queue()
+    get_query_executor().submit(stream_query, get_http_session(), payload, events)
+    event = events.get()
+    if event["event"] != "intent":
+        # The stream failed before the intent was known; leave the failure for wait_for_query_result
+        events.put(event)
+        return None, events
+    if event["intent"] == "unclear":
+        return event, None
+    return event, events
+
+def wait_for_query_result(events):
+    """Show the agent's steps as they stream in, returning (result, error) once it answers."""
+    progress = st.empty()
+    steps = 0
+    while True:
+        event = events.get()
+        if event["event"] == "step":
+            steps += 1
+            progress.caption(f"🔧 Step {steps}: running `{event['tool']}`...")
+            continue
+        
+        progress.empty()
+        if event["event"] == "result":
+            return event, None
+        if event["event"] == "error":
+            return None, event["detail"]
+        st.error(f"Connection error: {event['detail']}")
+        return None, None
+
+@st.cache_data(max_entries=CODE_BLOCK_CACHE_SIZE, show_spinner=False)
 def extract_code_blocks(text):
-    """Extract code blocks from text and return (clean_text, code_blocks)."""
-    # Pattern to match code blocks (```python ... ``` or ``` ... ```)
-    code_pattern = r'```(?:python)?\s*\n?(.*?)\n?```'
-    code_blocks = re.findall(code_pattern, text, re.DOTALL)
+    """Extract code blocks from text and return (clean_text, code_blocks); cached per message text."""
+    # Match code blocks (```python ... ``` or ``` ... ```)
+    code_blocks = CODE_BLOCK_RE.findall(text)
     
     # Filter out useless code blocks and duplicates
     meaningful_blocks = []
@@ -106,7 +240,7 @@ def extract_code_blocks(text):
             continue
             
         # Skip blocks that are just single variable assignments (like just "fig")
-        if re.match(r'^[a-zA-Z_][a-zA-Z0-9_]*\s*$', block):
+        if TRIVIAL_ASSIGN_RE.match(block):
             continue
             
         # Skip blocks that are just "fig" or similar single assignments
@@ -114,43 +248,23 @@ def extract_code_blocks(text):
             continue
             
         # Skip blocks that are just variable assignments without meaningful code
-        if (block.startswith('fig') and 
-            not re.search(r'import\s+', block) and 
-            not re.search(r'px\.', block) and
-            not re.search(r'pd\.', block)):
+        if block.startswith('fig') and not PLOTTING_CODE_RE.search(block):
             continue
             
-        # Must contain substantial code (imports, function calls, etc.)
-        if (re.search(r'import\s+', block) or 
-            re.search(r'def\s+', block) or 
-            re.search(r'class\s+', block) or
-            re.search(r'px\.', block) or
-            re.search(r'pd\.', block) or
-            re.search(r'\.\w+\s*\(', block) or
-            re.search(r'=\s*\w+\s*\(', block) or
-            re.search(r'for\s+', block) or
-            re.search(r'if\s+', block) or
-            re.search(r'#', block) or
-            re.search(r'x=', block) or
-            re.search(r'y=', block) or
-            re.search(r'color=', block) or
-            re.search(r'title=', block) or
-            re.search(r'facet_', block) or
-            re.search(r'hover_data', block)):
+        # Must contain substantial code (imports, function calls, etc.) - one scan over the alternation
+        if MEANINGFUL_CODE_RE.search(block):
             
-            # Avoid duplicates by checking if we've seen this block before
-            block_hash = hash(block)
-            if block_hash not in seen_blocks:
+            # Avoid duplicates, treating blocks that differ only in whitespace as the same
+            normalized = ' '.join(block.split())
+            if normalized not in seen_blocks:
                 meaningful_blocks.append(block)
-                seen_blocks.add(block_hash)
+                seen_blocks.add(normalized)
     
     # Remove code blocks from the original text
-    clean_text = re.sub(code_pattern, '', text, flags=re.DOTALL)
+    clean_text = CODE_BLOCK_RE.sub('', text)
     
     # Clean up extra whitespace
-    clean_text = re.sub(r'\n\s*\n', '\n\n', clean_text).strip()
-    
-    return clean_text, meaningful_blocks
+    return BLANK_LINES_RE.sub('\n\n', clean_text).strip(), meaningful_blocks
 
 def display_message_with_code(content, message_type=None):
     """Display a message with collapsible code blocks."""
@@ -188,15 +302,139 @@ def display_message_with_code(content, message_type=None):
             st.info("🔍 No significant code blocks found in this response. The AI agent may have used internal processing or returned a simple result.")
             st.code("# This response didn't contain detailed code implementation\n# The visualization was generated using internal AI processing", language="python")
 
-def generate_suggested_questions(data_info):
-    """Generate 5 smart visualization questions based on the dataset."""
-    if not data_info:
+def render_suggestions(i, message):
+    """Render the suggested questions message as clickable buttons."""
+    st.write(message["content"])
+    for j, question in enumerate(message.get("questions", [])):
+        st.button(f"💡 {question}", key=f"suggestion_{i}_{j}", help="Click to use this question",
+                  on_click=set_query, args=(question,))
+
+def render_visualization(i, message):
+    """Render an agent answer together with its chart."""
+    if not message.get("json"):
+        render_text(i, message)
+        return
+    display_message_with_code(message["content"])
+    st.write(VISUALIZATION_CAPTION)
+    # Display the interactive visualization using Plotly, parsed once per message
+    fig = message.get("figure")
+    if fig is None:
+        import plotly.io as pio
+        fig = message["figure"] = pio.from_json(message["json"])
+    st.plotly_chart(fig, use_container_width=True, key=f"plotly_chart_{i}")
+
+def render_text(i, message):
+    """Render a plain message with collapsible code blocks."""
+    display_message_with_code(message["content"], message.get("type"))
+
+# Chat message renderers by message type; any other type is shown as text
+MESSAGE_RENDERERS = {
+    "suggestions": render_suggestions,
+    "visualization": render_visualization,
+}
+
+def categorize_columns(data_info):
+    """Split the server's column categorization into (numeric, categorical, datetime) lists."""
+    return (
+        data_info.get('numeric_columns', []),
+        data_info.get('categorical_columns', []),
+        data_info.get('datetime_columns', [])
+    )
+
+def get_column_categories():
+    """Get the column categories for the uploaded data, computed once per upload."""
+    if st.session_state.col_cats is None:
+        st.session_state.col_cats = categorize_columns(st.session_state.data_info)
+    return st.session_state.col_cats
+
+def build_column_picker_spec(col_cats, all_columns):
+    """Build the column picker sections as (title, widget key, columns)."""
+    numeric_cols, categorical_cols, datetime_cols = col_cats
+    # If no categorized columns, fallback to all columns
+    if not numeric_cols and not categorical_cols and not datetime_cols:
+        return [("📋 All Columns", "all_pick", all_columns)]
+    
+    sections = [
+        ("📊 Numeric Columns", "num_pick", numeric_cols),
+        ("🏷️ Categorical Columns", "cat_pick", categorical_cols)
+    ]
+    if datetime_cols:
+        sections.append(("📅 DateTime Columns", "dt_pick", datetime_cols))
+    return sections
+
+def get_column_picker_spec():
+    """Get the column picker spec for the uploaded data, built once per upload."""
+    if st.session_state.col_picker_spec is None:
+        st.session_state.col_picker_spec = build_column_picker_spec(
+            get_column_categories(), st.session_state.data_info.get('columns', [])
+        )
+    return st.session_state.col_picker_spec
+
+def build_column_info(data_info):
+    """Build the per-column overview table shown in the data preview."""
+    dtypes = data_info.get('dtypes', {})
+    return pd.DataFrame({"Column": list(dtypes.keys()), "Type": list(dtypes.values())})
+
+def get_column_info():
+    """Get the column overview table for the uploaded data, built once per upload."""
+    if st.session_state.column_info is None:
+        st.session_state.column_info = build_column_info(st.session_state.data_info)
+    return st.session_state.column_info
+
+def get_query_text():
+    """Get the chat input text built from the query tokens."""
+    return " ".join(st.session_state.chat_tokens)
+
+def query_input_key():
+    """Get the widget key of the current query box."""
+    return f"text_input_query_{st.session_state.input_key}"
+
+def sync_typed_query():
+    """Keep text typed into the query box, so rebuilding the box from the tokens doesn't drop it."""
+    typed = st.session_state.get(query_input_key())
+    if typed is not None and typed != get_query_text():
+        st.session_state.chat_tokens = [typed] if typed else []
+
+def append_to_query(*texts):
+    """Append text to the chat input and refresh the input box."""
+    sync_typed_query()
+    st.session_state.chat_tokens.extend(texts)
+    st.session_state.input_key += 1
+
+def append_picked_columns(key):
+    """Add the columns picked in a multiselect to the chat input, then reset the widget."""
+    picked = st.session_state[key]
+    if picked:
+        append_to_query(*picked)
+        st.session_state[key] = []
+
+def set_query(text):
+    """Replace the chat input with the given text."""
+    st.session_state.chat_tokens = [text] if text else []
+    st.session_state.input_key += 1
+
+def undo_last_word():
+    """Remove the last word from the chat input."""
+    sync_typed_query()
+    tokens = st.session_state.chat_tokens
+    if tokens:
+        # Tokens like "show basic statistics" hold several words; drop only the last one
+        head, _, _ = tokens.pop().rstrip().rpartition(" ")
+        if head.strip():
+            tokens.append(head.rstrip())
+        st.session_state.input_key += 1
+
+def expand_chat_history():
+    """Render another window of older chat messages."""
+    st.session_state.history_window += CHAT_HISTORY_WINDOW
+
+def generate_suggested_questions(col_cats):
+    """Generate 5 smart visualization questions based on the dataset's column categories."""
+    if not col_cats:
         return []
     
     questions = []
-    numeric_cols = data_info.get('numeric_columns', [])
-    categorical_cols = data_info.get('categorical_columns', [])
-    datetime_cols = data_info.get('datetime_columns', [])
+    numeric_cols, categorical_cols, datetime_cols = col_cats
     
     # Question 1: Basic overview
     if len(numeric_cols) > 0:
@@ -231,142 +469,127 @@ def setup_column_selection_ui():
     if st.session_state.data_info:
         # Sidebar for column picker
         st.sidebar.header("📝 Column Picker")
-        st.sidebar.write("Click column names to add them to your query:")
+        st.sidebar.write("Pick column names to add them to your query:")
         
         # Column categories for better UX
-        numeric_cols = st.session_state.data_info.get('numeric_columns', [])
-        categorical_cols = st.session_state.data_info.get('categorical_columns', [])
-        datetime_cols = st.session_state.data_info.get('datetime_columns', [])
+        numeric_cols, categorical_cols, datetime_cols = get_column_categories()
         
         # Debug info (remove in production)
         st.sidebar.write(f"**Debug:** Found {len(numeric_cols)} numeric, {len(categorical_cols)} categorical, {len(datetime_cols)} datetime columns")
         
-        # Debug toggle
-        if st.sidebar.checkbox("🐛 Debug Mode", value=False):
-            st.session_state.debug_mode = True
-        else:
-            st.session_state.debug_mode = False
-        
-        # If no categorized columns, fallback to all columns
-        if not numeric_cols and not categorical_cols and not datetime_cols:
-            all_cols = st.session_state.data_info.get('columns', [])
-            st.sidebar.write("**All Columns:**")
-            for col in all_cols:
-                if st.sidebar.button(f"📋 {col}", key=f"all_{col}", help=f"Click to add '{col}' to your query"):
-                    current_text = st.session_state.get('chat_input', '') or ''
-                    if current_text.strip():
-                        new_text = current_text + f" {col}"
-                    else:
-                        new_text = col
-                    st.session_state.chat_input = new_text
-                    st.session_state.input_key += 1
-                    st.rerun()
-        else:
-            # Clickable column buttons - always additive
-            st.sidebar.subheader("📊 Numeric Columns")
-            for col in numeric_cols:
-                if st.sidebar.button(f"📊 {col}", key=f"num_{col}", help=f"Click to add '{col}' to your query"):
-                    # Get current chat input value
-                    current_text = st.session_state.get('chat_input', '') or ''
-                    
-                    # Always add column to chat input (no selection tracking)
-                    if current_text.strip():
-                        new_text = current_text + f" {col}"
-                    else:
-                        new_text = col
-                    st.session_state.chat_input = new_text
-                    st.session_state.input_key += 1
-                    st.rerun()
+        # Debug toggle - debug output is in the chat history, outside this fragment, so redraw the app
+        debug_mode = st.sidebar.checkbox("🐛 Debug Mode", value=False)
+        if debug_mode != st.session_state.get('debug_mode', False):
+            st.session_state.debug_mode = debug_mode
+            st.rerun()
         
-            st.sidebar.subheader("🏷️ Categorical Columns")
-            for col in categorical_cols:
-                if st.sidebar.button(f"🏷️ {col}", key=f"cat_{col}", help=f"Click to add '{col}' to your query"):
-                    # Get current chat input value
-                    current_text = st.session_state.get('chat_input', '') or ''
-                    
-                    # Always add column to chat input (no selection tracking)
-                    if current_text.strip():
-                        new_text = current_text + f" {col}"
-                    else:
-                        new_text = col
-                    st.session_state.chat_input = new_text
-                    st.session_state.input_key += 1
-                    st.rerun()
-            
-            if datetime_cols:
-                st.sidebar.subheader("📅 DateTime Columns")
-                for col in datetime_cols:
-                    if st.sidebar.button(f"📅 {col}", key=f"dt_{col}", help=f"Click to add '{col}' to your query"):
-                        # Get current chat input value
-                        current_text = st.session_state.get('chat_input', '') or ''
-                        
-                        # Always add column to chat input (no selection tracking)
-                        if current_text.strip():
-                            new_text = current_text + f" {col}"
-                        else:
-                            new_text = col
-                        st.session_state.chat_input = new_text
-                        st.session_state.input_key += 1
-                        st.rerun()
+        # One picker per column category - picks are always added to the query
+        for title, key, columns in get_column_picker_spec():
+            st.sidebar.multiselect(
+                title,
+                columns,
+                key=key,
+                placeholder="Pick columns to add",
+                on_change=append_picked_columns,
+                args=(key,)
+            )
         
+        if numeric_cols or categorical_cols or datetime_cols:
             # Query builder controls
             st.sidebar.subheader("🛠️ Query Builder")
             col1, col2 = st.sidebar.columns(2)
         
+            # Callbacks update the query before the rerun, so no extra st.rerun() round-trip is needed
             with col1:
-                if st.button("🗑️ Clear", key="clear_query", help="Clear the current query"):
-                    st.session_state.chat_input = ""
-                    st.session_state.input_key += 1
-                    st.rerun()
+                st.button("🗑️ Clear", key="clear_query", help="Clear the current query",
+                          on_click=set_query, args=("",))
             
             with col2:
-                if st.button("⬅️ Undo", key="undo_query", help="Remove last word"):
-                    # Get current chat input
-                    current_text = st.session_state.get('chat_input', '') or ''
-                    if current_text.strip():
-                        # Remove last word from chat input
-                        words = current_text.strip().split()
-                        if words:
-                            new_text = " ".join(words[:-1])
-                            st.session_state.chat_input = new_text
-                            st.session_state.input_key += 1
-                    st.rerun()
+                st.button("⬅️ Undo", key="undo_query", help="Remove last word", on_click=undo_last_word)
         
             # Quick Analysis Buttons
             st.sidebar.subheader("🚀 Quick Analysis")
+            for label, key, text in QUICK_ANALYSIS_BUTTONS:
+                st.sidebar.button(label, key=key, on_click=append_to_query, args=(text,))
+
+    else:
+        st.sidebar.info("🔄 Processing query...")
+
+def render_query_form():
+    """Render the query box and process a submitted query."""
+    # Chat input with proper value handling
+    placeholder_text = "Type your question or use column picker above (e.g., 'plot', 'correlation between', 'analyze')"
+    
+    # Typed text is synced into the tokens, so the column picker and query builder append to it
+    user_input = st.text_input(
+        "Ask a question about your data:",
+        value=get_query_text(),
+        placeholder=placeholder_text,
+        key=query_input_key(),
+        on_change=sync_typed_query
+    )
+    
+    # Send button
+    col1, col2 = st.columns([4, 1])
+    with col2:
+        submitted = st.button("Send", key="send_button", type="primary")
+    
+    if submitted:
+        # The sent text (possibly edited by hand) replaces the tokens it was built from
+        st.session_state.chat_tokens = []
+        if user_input.strip():
+            final_query = user_input.strip()
             
-            if st.sidebar.button("📊 Basic Stats", key="quick_stats"):
-                current_text = st.session_state.get('chat_input', '') or ''
-                st.session_state.chat_input = current_text + " show basic statistics"
-                st.session_state.input_key += 1
-                st.rerun()
-            
-            if st.sidebar.button("🔗 Correlation", key="quick_corr"):
-                current_text = st.session_state.get('chat_input', '') or ''
-                st.session_state.chat_input = current_text + " show correlation matrix"
-                st.session_state.input_key += 1
-                st.rerun()
+            # Increment key to force the input box to reset
+            st.session_state.input_key += 1
             
-            if st.sidebar.button("📈 Value Counts", key="quick_counts"):
-                current_text = st.session_state.get('chat_input', '') or ''
-                st.session_state.chat_input = current_text + " show value counts"
-                st.session_state.input_key += 1
-                st.rerun()
+            # Add user message
+            st.session_state.messages.append({"role": "user", "content": final_query})
             
-            if st.sidebar.button("📊 Histogram", key="quick_hist"):
-                current_text = st.session_state.get('chat_input', '') or ''
-                st.session_state.chat_input = current_text + " create histogram"
-                st.session_state.input_key += 1
-                st.rerun()
+            # Process the query
+            with st.spinner("Processing your request..."):
+                # Analyze the query intent while the agent works on it
+                analysis, events = analyze_and_process_query(final_query)
+                
+                if analysis and analysis.get("intent") == "unclear":
+                    # Intent is unclear - show simple message
+                    st.session_state.messages.append({
+                        "role": "assistant",
+                        "content": "I'm sorry, I don't understand that request. Please try rephrasing, or use the column picker to help build your query."
+                    })
+                else:
+                    # Intent is clear - use the agent's response, showing its steps meanwhile
+                    result, error = wait_for_query_result(events)
+                    if result is not None:
+                        assistant_response = result.get("response", "I'm sorry, I couldn't get a response.")
+                        message = {"role": "assistant", "content": assistant_response}
+                        
+                        if result.get("visualization_generated"):
+                            # Keep the chart in the same message as the answer it belongs to
+                            if result.get("visualization_json"):
+                                message["type"] = "visualization"
+                                message["json"] = result["visualization_json"]
+                            else:
+                                message["content"] = f"{assistant_response}\n\n{VISUALIZATION_CAPTION}"
+                        st.session_state.messages.append(message)
+                    elif error:
+                        st.error(f"❌ Error from API: {error}")
+                        st.session_state.messages.append({
+                            "role": "assistant",
+                            "content": f"Error from API: {error}"
+                        })
+                    else:
+                        st.error("❌ Failed to connect to the API server.")
             
-            if st.sidebar.button("📈 Scatter Plot", key="quick_scatter"):
-                current_text = st.session_state.get('chat_input', '') or ''
-                st.session_state.chat_input = current_text + " create scatter plot"
-                st.session_state.input_key += 1
-                st.rerun()
+            # Force rerun to update the UI and clear the input
+            st.rerun()
 
-    else:
-        st.sidebar.info("🔄 Processing query...")
+@st.fragment
+def query_builder():
+    """Column picker sidebar and query box, rerun on their own so picks don't redraw the chat history."""
+    if st.session_state.data_info:
+        setup_column_selection_ui()
+    render_query_form()
 
 def main():
     st.title("🤖 Data Scientist AI Agent (Client-Server Edition)")
@@ -377,154 +600,83 @@ def main():
         st.error("🚨 **Connection Error**: The FastAPI server is not running. Please start it with: `uvicorn api:app --reload`")
         st.stop()
     
-    # Display chat messages
-    for i, message in enumerate(st.session_state.messages):
+    # Display chat messages - only the most recent window, so reruns don't re-send the whole history
+    messages = st.session_state.messages
+    recent = messages[-st.session_state.history_window:]
+    offset = len(messages) - len(recent)
+    if offset:
+        st.button(f"⬆️ Show {offset} older messages", key="show_older_messages", on_click=expand_chat_history)
+    
+    for j, message in enumerate(recent):
+        i = offset + j
         with st.chat_message(message["role"]):
-            if message.get("type") == "suggestions":
-                st.write(message["content"])
-                # Display clickable suggested questions
-                questions = message.get("questions", [])
-                for j, question in enumerate(questions):
-                    if st.button(f"💡 {question}", key=f"suggestion_{i}_{j}", help="Click to use this question"):
-                        st.session_state.chat_input = question
-                        st.session_state.input_key += 1
-                        st.rerun()
-            elif message.get("type") == "visualization" and message.get("json"):
-                st.write(message["content"])
-                # Display the interactive visualization using Plotly
-                chart_data = json.loads(message["json"])
-                fig = go.Figure(chart_data)
-                st.plotly_chart(fig, use_container_width=True, key=f"plotly_chart_{i}")
-            else:
-                # Use the new function to display messages with collapsible code
-                display_message_with_code(message["content"], message.get("type"))
+            MESSAGE_RENDERERS.get(message.get("type"), render_text)(i, message)
     
-    # Always show sidebar info
-    if st.session_state.df_uploaded and st.session_state.data_info:
-        setup_column_selection_ui()
-    else:
+    # Always show sidebar info (the column picker itself is drawn by query_builder)
+    if not (st.session_state.df_uploaded and st.session_state.data_info):
         st.sidebar.header("📁 Upload Data")
         st.sidebar.info("Upload a CSV or Excel file to start analyzing your data with AI!")
     
     # File uploader
     if not st.session_state.df_uploaded:
         uploaded_file = st.file_uploader("Upload your data file", type=['csv', 'xlsx', 'xls'])
-        if uploaded_file:
-            with st.spinner("Uploading and processing file..."):
-                response = upload_file_to_api(uploaded_file)
-                if response and response.status_code == 200:
-                    result = response.json()
-                    st.session_state.df_uploaded = True
-                    st.session_state.data_info = result
-                    
-                    st.success(f"✅ File uploaded successfully! Your dataset has {result['shape'][0]} rows and {result['shape'][1]} columns.")
-                    
-                    # Add welcome message
-                    st.session_state.messages.append({
-                        "role": "assistant", 
-                        "content": f"File uploaded successfully! Your dataset has {result['shape'][0]} rows and {result['shape'][1]} columns. Here are some suggested questions to get you started:"
-                    })
-                    
-                    # Generate and show suggested questions
-                    suggested_questions = generate_suggested_questions(result)
-                    st.session_state.messages.append({
-                        "role": "assistant",
-                        "content": "**🎯 Suggested Questions:**",
-                        "type": "suggestions",
-                        "questions": suggested_questions
-                    })
-                    
-                    # Show data preview
-                    with st.expander("📊 Data Preview"):
-                        st.write("**Dataset Information:**")
-                        st.json({
-                            "Shape": result['shape'],
-                            "Columns": result['columns'],
-                            "Data Types": result['dtypes']
-                        })
-                    
-                    st.rerun()
-                elif response:
-                    st.error(f"❌ Error uploading file: {response.text}")
-                else:
-                    st.error("❌ Failed to connect to the API server.")
+        if uploaded_file and uploaded_file.file_id != st.session_state.upload_file_id:
+            # Upload in the background so the page stays usable while the API parses the file
+            st.session_state.upload_file_id = uploaded_file.file_id
+            st.session_state.upload_future = upload_file_to_api(uploaded_file)
+        
+        future = st.session_state.upload_future
+        if future is not None and not future.done():
+            upload_status()
+        elif future is not None:
+            st.session_state.upload_future = None
+            try:
+                response = future.result()
+            except requests.exceptions.RequestException as e:
+                st.error(f"Connection error: {str(e)}")
+                response = None
+            if response and response.status_code == 200:
+                result = response.json()
+                st.session_state.df_uploaded = True
+                st.session_state.data_info = result
+                st.session_state.col_cats = categorize_columns(result)
+                st.session_state.col_picker_spec = None
+                st.session_state.column_info = None
+                
+                st.success(f"✅ File uploaded successfully! Your dataset has {result['shape'][0]} rows and {result['shape'][1]} columns.")
+                
+                # Add welcome message
+                st.session_state.messages.append({
+                    "role": "assistant", 
+                    "content": f"File uploaded successfully! Your dataset has {result['shape'][0]} rows and {result['shape'][1]} columns. Here are some suggested questions to get you started:"
+                })
+                
+                # Generate and show suggested questions
+                suggested_questions = generate_suggested_questions(st.session_state.col_cats)
+                st.session_state.messages.append({
+                    "role": "assistant",
+                    "content": "**🎯 Suggested Questions:**",
+                    "type": "suggestions",
+                    "questions": suggested_questions
+                })
+                
+                st.rerun()
+            elif response:
+                st.error(f"❌ Error uploading file: {response.text}")
+            else:
+                st.error("❌ Failed to connect to the API server.")
+    else:
+        # Show data preview from the table built at upload. An expander would still build and
+        # send the table on every rerun while collapsed, so it is only rendered when toggled on
+        if st.toggle("📊 Data Preview", key="show_preview"):
+            st.write("**Dataset Information:**")
+            shape = st.session_state.data_info['shape']
+            st.write(f"{shape[0]} rows × {shape[1]} columns")
+            st.dataframe(get_column_info(), use_container_width=True, hide_index=True)
     
-    # Chat input
+    # Column picker and query box (see query_builder)
     if st.session_state.df_uploaded:
-        # Chat input with proper value handling
-        placeholder_text = "Type your question or use column picker above (e.g., 'plot', 'correlation between', 'analyze')"
-        
-        # Use a text input instead of chat_input for better control
-        user_input = st.text_input(
-            "Ask a question about your data:",
-            value=st.session_state.get('chat_input', ''),
-            placeholder=placeholder_text,
-            key=f"text_input_query_{st.session_state.input_key}"
-        )
-        
-        # Update session state when user types
-        if user_input != st.session_state.get('chat_input', ''):
-            st.session_state.chat_input = user_input
-        
-        # Send button
-        col1, col2 = st.columns([4, 1])
-        with col2:
-            if st.button("Send", key="send_button", type="primary"):
-                if st.session_state.chat_input.strip():
-                    final_query = st.session_state.chat_input.strip()
-                    
-                    # Clear chat input after sending and increment key to force reset
-                    st.session_state.chat_input = ""
-                    st.session_state.input_key += 1
-                    
-                    # Add user message
-                    st.session_state.messages.append({"role": "user", "content": final_query})
-                    
-                    # Process the query
-                    with st.spinner("Processing your request..."):
-                        # First, analyze the query intent
-                        analysis = analyze_query_with_api(final_query)
-                        
-                        if analysis and analysis.get("intent") == "unclear":
-                            # Intent is unclear - show simple message
-                            st.session_state.messages.append({
-                                "role": "assistant",
-                                "content": "I'm sorry, I don't understand that request. Please try rephrasing, or use the column picker to help build your query."
-                            })
-                        else:
-                            # Intent is clear - process with agent
-                            response = process_query_with_api(final_query)
-                            
-                            if response and response.status_code == 200:
-                                result = response.json()
-                                assistant_response = result.get("response", "I'm sorry, I couldn't get a response.")
-                                st.session_state.messages.append({"role": "assistant", "content": assistant_response})
-                                
-                                if result.get("visualization_generated"):
-                                    # Display the visualization JSON
-                                    if result.get("visualization_json"):
-                                        st.session_state.messages.append({
-                                            "role": "assistant",
-                                            "content": "📊 **Interactive visualization generated!**",
-                                            "type": "visualization",
-                                            "json": result["visualization_json"]
-                                        })
-                                    else:
-                                        st.session_state.messages.append({
-                                            "role": "assistant",
-                                            "content": "📊 **Interactive visualization generated!**"
-                                        })
-                            elif response:
-                                st.error(f"❌ Error from API: {response.text}")
-                                st.session_state.messages.append({
-                                    "role": "assistant",
-                                    "content": f"Error from API: {response.text}"
-                                })
-                            else:
-                                st.error("❌ Failed to connect to the API server.")
-                    
-                    # Force rerun to update the UI and clear the input
-                    st.rerun()
+        query_builder()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
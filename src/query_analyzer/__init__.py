@@ -1,3 +1,3 @@
-from .main import analyze_query
+from .main import analyze_query, get_analyzer
 
-__all__ = ['analyze_query']
+__all__ = ['analyze_query', 'get_analyzer']
\ No newline at end of file
@@ -1,9 +1,63 @@
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.output_parsers import JsonOutputParser
+import asyncio
+import re
+from collections import OrderedDict
+from functools import lru_cache
+from typing import List, Optional
 
-from .prompts import INTENT_CLASSIFICATION_PROMPT
+import numpy as np
+from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
+from langchain_core.output_parsers import StrOutputParser
+from pydantic import TypeAdapter
+
+from .prompts import INTENT_BATCH_PROMPT, INTENT_CLASSIFICATION_PROMPT, INTENT_EXAMPLES
 from .schemas import QueryAnalysis
 
+# Keyword fallbacks used when the LLM call fails, built once instead of on every failed call
+VISUALIZATION_KEYWORDS = ('plot', 'chart', 'graph', 'visualize', 'show', 'create', 'over time', 'by', 'vs')
+DATA_SUMMARY_KEYWORDS = ('statistics', 'summary', 'analyze', 'count', 'mean', 'average', 'correlation')
+
+# Whole-word matches that classify a query without the LLM when exactly one of them hits
+VISUALIZATION_RE = re.compile(r'\b(?:plot|chart|graph|visualize|show|create|over time|vs)\b', re.IGNORECASE)
+DATA_SUMMARY_RE = re.compile(r'\b(?:statistics|summary|analyze|count|mean|average|correlation)\b', re.IGNORECASE)
+KEYWORD_CONFIDENCE = 0.9
+
+# Seconds to wait for the LLM before falling back to keyword classification
+INTENT_TIMEOUT = 5.0
+
+# LLM classifications kept for repeated queries (the model runs at low temperature, so repeats agree)
+ANALYSIS_CACHE_SIZE = 4096
+
+# Paraphrases ("plot quantity over time" / "chart quantity by date") share an intent, so a
+# close enough embedding reuses the cached classification too
+SEMANTIC_CACHE_THRESHOLD = 0.92
+EMBEDDING_MODEL = "models/text-embedding-004"
+EMBEDDING_TIMEOUT = 2.0  # Seconds; a slow embedding just skips the semantic lookup
+
+# A query whose embedding is this much closer to one intent's example centroid than to any other
+# is classified locally, without the LLM
+CENTROID_MARGIN = 0.15
+
+# Queries that arrive while a classification call is in flight are coalesced into one LLM call
+INTENT_BATCH_SIZE = 16
+INTENT_BATCH_WINDOW = 0.02  # Seconds to wait for more queries before sending a batch
+
+# The JSON inside a ```json fence, when the model adds one
+JSON_FENCE_RE = re.compile(r'```(?:json)?\s*(.*?)\s*```', re.DOTALL)
+QUERY_ANALYSIS_LIST = TypeAdapter(List[QueryAnalysis])
+
+def _strip_json_fence(text: str) -> str:
+    """Get the JSON payload of a model reply, without any markdown fence around it."""
+    match = JSON_FENCE_RE.search(text)
+    return match.group(1) if match else text.strip()
+
+def parse_analysis(text: str) -> QueryAnalysis:
+    """Parse and validate one classification straight from the model's JSON text."""
+    return QueryAnalysis.model_validate_json(_strip_json_fence(text))
+
+def parse_analysis_list(text: str) -> List[QueryAnalysis]:
+    """Parse and validate a batch of classifications straight from the model's JSON text."""
+    return QUERY_ANALYSIS_LIST.validate_json(_strip_json_fence(text))
+
 class QueryAnalyzer:
     def __init__(self, temperature: float = 0.1):
         """Initialize the simplified query analyzer.
@@ -17,7 +71,152 @@ class QueryAnalyzer:
         )
         
         # Initialize the intent classification chain
-        self.intent_chain = INTENT_CLASSIFICATION_PROMPT | self.llm | JsonOutputParser()
+        # The chains end in a single pydantic pass over the raw JSON text (no dict in between)
+        self.intent_chain = INTENT_CLASSIFICATION_PROMPT | self.llm | StrOutputParser() | parse_analysis
+        self.batch_chain = INTENT_BATCH_PROMPT | self.llm | StrOutputParser() | parse_analysis_list
+        self._in_flight = 0
+        self._pending = []  # (query, future) pairs waiting for the next batch
+        self._flush_handle = None
+        self._batch_tasks = set()  # Running batches; the loop only holds weak references to tasks
+        self._cache: "OrderedDict[str, dict]" = OrderedDict()
+        self._embeddings = None
+        self._centroids = None  # (intents, unit centroid per intent), built by prepare()
+        self._centroid_task = None  # Background prepare() when the analyzer wasn't prepared at startup
+    
+    async def _classify(self, query: str) -> QueryAnalysis:
+        """Get the LLM's classification for a query, batching it with others if the LLM is busy."""
+        if not self._in_flight:
+            # Nothing to share a call with: send it on its own right away
+            self._in_flight += 1
+            try:
+                return await self.intent_chain.ainvoke({"query": query})
+            finally:
+                self._in_flight -= 1
+        
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((query, future))
+        if len(self._pending) >= INTENT_BATCH_SIZE:
+            self._flush_batch()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(INTENT_BATCH_WINDOW, self._flush_batch)
+        return await future
+    
+    def _flush_batch(self):
+        """Send the pending queries as one batch."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._run_batch(batch))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+    
+    async def _run_batch(self, batch: list):
+        """Classify a batch of queries in one LLM call and resolve their futures."""
+        self._in_flight += 1
+        try:
+            if len(batch) == 1:
+                results = [await self.intent_chain.ainvoke({"query": batch[0][0]})]
+            else:
+                queries = "\n".join(f"{i}. {query}" for i, (query, _) in enumerate(batch, 1))
+                results = await self.batch_chain.ainvoke({"queries": queries})
+                if len(results) != len(batch):
+                    raise ValueError(f"Expected {len(batch)} classifications, got {results!r}")
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self._in_flight -= 1
+    
+    def prepare(self):
+        """Embed the labelled example queries into intent centroids (blocking; call at startup).
+
+        This is a batch of embedding calls, so it runs outside the per-query EMBEDDING_TIMEOUT.
+        """
+        try:
+            if self._embeddings is None:
+                self._embeddings = GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL)
+            if self._centroids is None:
+                self._centroids = self._build_centroids()
+        except Exception as e:
+            print(f"Warning: Intent centroids unavailable: {str(e)}")
+    
+    def prepare_in_background(self):
+        """Start prepare() in a worker thread unless the centroids exist or are being built; needs a running loop."""
+        if self._centroids is None and (self._centroid_task is None or self._centroid_task.done()):
+            self._centroid_task = asyncio.ensure_future(asyncio.to_thread(self.prepare))
+    
+    def _embed_query(self, query: str) -> Optional[np.ndarray]:
+        """Embed a query; returns None if embeddings are unavailable."""
+        try:
+            if self._embeddings is None:
+                self._embeddings = GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL)
+            vector = np.asarray(self._embeddings.embed_query(query), dtype=np.float32)
+            return vector / np.linalg.norm(vector)
+        except Exception as e:
+            print(f"Warning: Semantic intent cache unavailable: {str(e)}")
+            return None
+    
+    def _build_centroids(self) -> tuple:
+        """Embed the labelled example queries and average them into one unit vector per intent."""
+        intents = list(INTENT_EXAMPLES)
+        centroids = []
+        for intent in intents:
+            # Embedded as queries, like the queries they are compared with
+            vectors = np.asarray(
+                self._embeddings.embed_documents(list(INTENT_EXAMPLES[intent]), task_type="retrieval_query"),
+                dtype=np.float32
+            )
+            centroid = (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).mean(axis=0)
+            centroids.append(centroid / np.linalg.norm(centroid))
+        return intents, np.stack(centroids)
+    
+    def _classify_by_centroid(self, embedding: np.ndarray) -> Optional[QueryAnalysis]:
+        """Classify by the nearest intent centroid, or None when the best two are too close to call.
+
+        Never answers "unclear": rejecting a query is left to the LLM, which is told to be generous.
+        """
+        intents, centroids = self._centroids
+        scores = centroids @ embedding
+        second, top = np.partition(scores, -2)[-2:]
+        intent = intents[int(np.argmax(scores))]
+        if top - second <= CENTROID_MARGIN or intent == "unclear":
+            return None
+        return QueryAnalysis(intent=intent, confidence=float(np.clip(top, 0.0, 1.0)))
+    
+    def _lookup_cached_analysis(self, key: str, embedding: Optional[np.ndarray]) -> Optional[QueryAnalysis]:
+        """Find a cached LLM classification by normalized query, then by embedding similarity."""
+        match_key = key if key in self._cache else None
+        
+        if match_key is None and embedding is not None:
+            candidates = [
+                (cached_key, entry["embedding"])
+                for cached_key, entry in self._cache.items()
+                if entry["embedding"] is not None
+            ]
+            if candidates:
+                scores = np.stack([vector for _, vector in candidates]) @ embedding
+                best = int(np.argmax(scores))
+                if scores[best] >= SEMANTIC_CACHE_THRESHOLD:
+                    match_key = candidates[best][0]
+        
+        if match_key is None:
+            return None
+        self._cache.move_to_end(match_key)
+        return self._cache[match_key]["analysis"]
+    
+    def _store_cached_analysis(self, key: str, embedding: Optional[np.ndarray], analysis: QueryAnalysis):
+        """Cache an LLM classification, keeping at most ANALYSIS_CACHE_SIZE entries."""
+        self._cache[key] = {"analysis": analysis, "embedding": embedding}
+        self._cache.move_to_end(key)
+        if len(self._cache) > ANALYSIS_CACHE_SIZE:
+            self._cache.popitem(last=False)
     
     async def analyze_query(self, query: str) -> QueryAnalysis:
         """Analyze a user query to determine its intent.
@@ -28,24 +227,51 @@ class QueryAnalyzer:
         Returns:
             QueryAnalysis object containing the intent classification
         """
+        # Obvious queries are classified by keyword; ambiguous ones (both or neither) go to the LLM
+        is_visualization = VISUALIZATION_RE.search(query) is not None
+        if is_visualization != (DATA_SUMMARY_RE.search(query) is not None):
+            return QueryAnalysis(
+                intent="visualization" if is_visualization else "data_summary",
+                confidence=KEYWORD_CONFIDENCE
+            )
+        
+        # Normally started at startup; retried here if that failed or never ran
+        self.prepare_in_background()
+        
+        # Repeated or paraphrased queries reuse the earlier LLM answer
+        key = " ".join(query.lower().split())
+        embedding = None
+        if key not in self._cache:
+            try:
+                embedding = await asyncio.wait_for(asyncio.to_thread(self._embed_query, query), timeout=EMBEDDING_TIMEOUT)
+            except asyncio.TimeoutError:
+                print("Warning: Query embedding timed out, skipping the semantic intent cache")
+        cached = self._lookup_cached_analysis(key, embedding)
+        if cached is not None:
+            return cached
+        
+        # Clear-cut queries are decided by the nearest labelled examples; close calls go to the LLM
+        if embedding is not None and self._centroids is not None:
+            analysis = self._classify_by_centroid(embedding)
+            if analysis is not None:
+                return analysis
+        
         try:
-            # Run the intent classification chain
-            result = await self.intent_chain.ainvoke({"query": query})
-            
-            # Convert the result to a QueryAnalysis object
-            analysis = QueryAnalysis(**result)
+            # Run the intent classification chain; a timeout lands in the keyword fallback below
+            analysis = await asyncio.wait_for(self._classify(query), timeout=INTENT_TIMEOUT)
+            self._store_cached_analysis(key, embedding, analysis)
             
             return analysis
             
         except Exception as e:
             # For now, let's be more generous and assume it's a visualization if it contains plot/chart keywords
             query_lower = query.lower()
-            if any(keyword in query_lower for keyword in ['plot', 'chart', 'graph', 'visualize', 'show', 'create', 'over time', 'by', 'vs']):
+            if any(keyword in query_lower for keyword in VISUALIZATION_KEYWORDS):
                 return QueryAnalysis(
                     intent="visualization",
                     confidence=0.7
                 )
-            elif any(keyword in query_lower for keyword in ['statistics', 'summary', 'analyze', 'count', 'mean', 'average', 'correlation']):
+            elif any(keyword in query_lower for keyword in DATA_SUMMARY_KEYWORDS):
                 return QueryAnalysis(
                     intent="data_summary",
                     confidence=0.7
@@ -57,15 +283,11 @@ class QueryAnalyzer:
                     confidence=0.0
                 )
 
-# Create a singleton instance of the QueryAnalyzer (lazy initialization)
-analyzer = None
-
-def get_analyzer():
+# Process-wide QueryAnalyzer, created on first use so importing this module builds no Gemini client
+@lru_cache(maxsize=1)
+def get_analyzer() -> QueryAnalyzer:
     """Get or create the analyzer instance."""
-    global analyzer
-    if analyzer is None:
-        analyzer = QueryAnalyzer()
-    return analyzer
+    return QueryAnalyzer()
 
 # Public API function
 async def analyze_query(query: str) -> QueryAnalysis:
@@ -1,4 +1,27 @@
 from langchain.prompts import ChatPromptTemplate
+from langchain_core.messages import SystemMessage
+
+# Labelled example queries per intent; shown to the LLM and used for the local nearest-centroid classifier
+INTENT_EXAMPLES = {
+    "visualization": (
+        "Plot Quantity over time using OrderDate",
+        "Create a bar chart of sales",
+        "Show me a scatter plot",
+        "Graph revenue by month",
+        "Visualize the data",
+    ),
+    "data_summary": (
+        "Show basic statistics",
+        "What's the average price?",
+        "Count the records",
+        "Analyze the correlation",
+    ),
+    "unclear": (
+        "asdfghjkl",
+        "hello",
+        "what is the weather?",
+    ),
+}
 
 # Simplified intent classification system
 INTENT_CLASSIFICATION_SYSTEM = """You are an AI that classifies user queries about data analysis into simple intent categories.
@@ -10,36 +33,30 @@ Available intents:
 
 IMPORTANT: Be VERY generous with classification. If a query mentions any data columns, chart types, or analysis terms, classify it as visualization or data_summary rather than unclear. Only use "unclear" for completely nonsensical or irrelevant requests.
 
-Examples of what should be "visualization":
-- "Plot Quantity over time using OrderDate" → visualization
-- "Create a bar chart of sales" → visualization  
-- "Show me a scatter plot" → visualization
-- "Graph revenue by month" → visualization
-- "Visualize the data" → visualization
-
-Examples of what should be "data_summary":
-- "Show basic statistics" → data_summary
-- "What's the average price?" → data_summary
-- "Count the records" → data_summary
-- "Analyze the correlation" → data_summary
-
-Examples of what should be "unclear":
-- "asdfghjkl" → unclear
-- "hello" → unclear
-- "what is the weather?" → unclear
-"""
-
-# Simplified intent classification prompt
+{examples}
+
+Classify each user query and respond with JSON. Remember to be VERY generous - if the query mentions any data analysis terms, columns, or chart types, classify it as visualization or data_summary rather than unclear.
+
+{
+    "intent": "visualization" | "data_summary" | "unclear",
+    "confidence": 0.0-1.0
+}
+""".replace("{examples}", "\n\n".join(
+    f'Examples of what should be "{intent}":\n' + "\n".join(f'- "{query}" → {intent}' for query in queries)
+    for intent, queries in INTENT_EXAMPLES.items()
+))
+
+# Simplified intent classification prompt. The system message is a fixed message rather than a
+# template, and the user's query is the only part that varies, so the whole instruction block is
+# an identical prefix on every call (which provider-side prompt caching can reuse)
 INTENT_CLASSIFICATION_PROMPT = ChatPromptTemplate.from_messages([
-    ("system", INTENT_CLASSIFICATION_SYSTEM),
-    ("human", """
-    User query: {query}
-    
-    Classify this query and respond with JSON. Remember to be VERY generous - if the query mentions any data analysis terms, columns, or chart types, classify it as visualization or data_summary rather than unclear.
-    
-    {{
-        "intent": "visualization" | "data_summary" | "unclear",
-        "confidence": 0.0-1.0
-    }}
-    """)
+    SystemMessage(content=INTENT_CLASSIFICATION_SYSTEM),
+    ("human", "User query: {query}")
+])
+
+# Several queries in one call: same fixed system prefix, with the numbered queries in the human turn
+INTENT_BATCH_PROMPT = ChatPromptTemplate.from_messages([
+    SystemMessage(content=INTENT_CLASSIFICATION_SYSTEM),
+    ("human", "Classify each of these user queries separately. Respond with a JSON list holding one "
+              "object like the one above per query, in the same order:\n{queries}")
 ])
@@ -2,8 +2,22 @@
 Testing module for AI Agent evaluation
 """
 
+import importlib
+
 from .test_questions import TestQuestionBank
-from .test_runner import TestRunner
-from .results_analyzer import TestResultsAnalyzer
+
+# TestRunner pulls in the agent (LangChain, Gemini) and TestResultsAnalyzer pulls in
+# Streamlit and Plotly, so they are imported on first access rather than with the package
+_LAZY_EXPORTS = {
+    'TestRunner': '.test_runner',
+    'TestResultsAnalyzer': '.results_analyzer',
+}
+
+def __getattr__(name):
+    if name in _LAZY_EXPORTS:
+        value = getattr(importlib.import_module(_LAZY_EXPORTS[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 __all__ = ['TestQuestionBank', 'TestRunner', 'TestResultsAnalyzer']
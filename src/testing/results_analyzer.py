@@ -4,14 +4,89 @@ Creates visualizations and detailed analysis of test performance
 """
 
 import json
+import numpy as np
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
-from plotly.subplots import make_subplots
 import streamlit as st
 from typing import Dict, List
 from datetime import datetime
 
+# Chart builders are cached on the data they plot, so Streamlit reruns reuse the figures
+# instead of rebuilding them; callers pass only the columns a chart needs
+@st.cache_data(show_spinner=False)
+def build_category_performance_chart(df: pd.DataFrame) -> go.Figure:
+    """Build the average score by category bar chart."""
+    category_stats = df.groupby('category').agg(
+        avg_score=('score', 'mean'),
+        pass_rate=('passed', 'mean')
+    ).reset_index()
+    category_stats['pass_rate'] *= 100
+    
+    fig = px.bar(
+        category_stats,
+        x='category',
+        y='avg_score',
+        title='Average Score by Category',
+        labels={'avg_score': 'Average Score (%)', 'category': 'Category'},
+        text='avg_score'
+    )
+    fig.update_traces(texttemplate='%{text:.1f}%', textposition='outside')
+    fig.update_layout(showlegend=False)
+    return fig
+
+@st.cache_data(show_spinner=False)
+def build_difficulty_performance_chart(df: pd.DataFrame) -> go.Figure:
+    """Build the average score by difficulty bar chart."""
+    difficulty_stats = df.groupby('difficulty').agg(avg_score=('score', 'mean')).reset_index()
+    
+    fig = px.bar(
+        difficulty_stats,
+        x='difficulty',
+        y='avg_score',
+        title='Average Score by Difficulty',
+        labels={'avg_score': 'Average Score (%)', 'difficulty': 'Difficulty'},
+        color='difficulty',
+        text='avg_score'
+    )
+    fig.update_traces(texttemplate='%{text:.1f}%', textposition='outside')
+    return fig
+
+@st.cache_data(show_spinner=False)
+def build_score_distribution_chart(scores: np.ndarray) -> go.Figure:
+    """Build the score distribution histogram."""
+    fig = px.histogram(
+        x=scores,
+        nbins=10,
+        title='Score Distribution',
+        labels={'x': 'Score (%)', 'y': 'Number of Tests'},
+        range_x=[0, 100]
+    )
+    
+    # Add pass/fail line
+    fig.add_vline(x=75, line_dash="dash", line_color="red", 
+                 annotation_text="Pass Threshold (75%)")
+    return fig
+
+@st.cache_data(show_spinner=False)
+def build_execution_time_chart(df: pd.DataFrame) -> go.Figure:
+    """Build the execution time by question scatter plot."""
+    return px.scatter(
+        df,
+        x='question_id',
+        y='execution_time',
+        color='category',
+        size='score',
+        title='Execution Time by Question',
+        labels={'execution_time': 'Execution Time (s)', 'question_id': 'Question ID', 'score': 'Score (%)'},
+        hover_data=['difficulty', 'question']
+    )
+
+@st.cache_resource(show_spinner=False)
+def load_results_analyzer(data: bytes) -> "TestResultsAnalyzer":
+    """Build the analyzer for an uploaded results file, once per distinct file."""
+    return TestResultsAnalyzer(results_data=json.loads(data))
+
 class TestResultsAnalyzer:
     """Analyzes and visualizes test results."""
     
@@ -25,6 +100,10 @@ class TestResultsAnalyzer:
             raise ValueError("Either results_file or results_data must be provided")
         
         self.df = pd.DataFrame(self.results)
+        # Scores flattened out of the nested evaluation dicts once, so charts aggregate with vectorized pandas
+        self.df['score'] = [r['evaluation']['score'] for r in self.results]
+        self.df['passed'] = self.df['score'] >= 75
+        self._failed_mask = ~self.df['passed'].to_numpy()
     
     def create_overview_dashboard(self):
         """Create a comprehensive overview dashboard."""
@@ -32,11 +111,11 @@ class TestResultsAnalyzer:
             st.error("No test results to analyze")
             return
         
-        # Calculate summary stats
-        total_tests = len(self.results)
-        passed_tests = sum(1 for r in self.results if r["evaluation"]["score"] >= 75)
-        avg_score = sum(r["evaluation"]["score"] for r in self.results) / total_tests
-        avg_time = sum(r["execution_time"] for r in self.results) / total_tests
+        # Calculate summary stats from the flattened columns
+        total_tests = len(self.df)
+        passed_tests = int(self.df['passed'].sum())
+        avg_score = self.df['score'].mean()
+        avg_time = self.df['execution_time'].mean()
         
         # Header metrics
         col1, col2, col3, col4 = st.columns(4)
@@ -95,82 +174,24 @@ class TestResultsAnalyzer:
     
     def _create_category_performance_chart(self):
         """Create category performance bar chart."""
-        category_stats = self.df.groupby('category').agg({
-            'evaluation': lambda x: [r['score'] for r in x],
-            'question_id': 'count'
-        }).reset_index()
-        
-        category_stats['avg_score'] = category_stats['evaluation'].apply(lambda x: sum(x) / len(x))
-        category_stats['pass_rate'] = category_stats['evaluation'].apply(
-            lambda x: sum(1 for score in x if score >= 75) / len(x) * 100
-        )
-        
-        fig = px.bar(
-            category_stats,
-            x='category',
-            y='avg_score',
-            title='Average Score by Category',
-            labels={'avg_score': 'Average Score (%)', 'category': 'Category'},
-            text='avg_score'
-        )
-        fig.update_traces(texttemplate='%{text:.1f}%', textposition='outside')
-        fig.update_layout(showlegend=False)
-        
+        fig = build_category_performance_chart(self.df[['category', 'score', 'passed']])
         st.plotly_chart(fig, use_container_width=True)
     
     def _create_difficulty_performance_chart(self):
         """Create difficulty performance chart."""
-        difficulty_stats = self.df.groupby('difficulty').agg({
-            'evaluation': lambda x: [r['score'] for r in x],
-            'question_id': 'count'
-        }).reset_index()
-        
-        difficulty_stats['avg_score'] = difficulty_stats['evaluation'].apply(lambda x: sum(x) / len(x))
-        
-        fig = px.bar(
-            difficulty_stats,
-            x='difficulty',
-            y='avg_score',
-            title='Average Score by Difficulty',
-            labels={'avg_score': 'Average Score (%)', 'difficulty': 'Difficulty'},
-            color='difficulty',
-            text='avg_score'
-        )
-        fig.update_traces(texttemplate='%{text:.1f}%', textposition='outside')
-        
+        fig = build_difficulty_performance_chart(self.df[['difficulty', 'score']])
         st.plotly_chart(fig, use_container_width=True)
     
     def _create_score_distribution_chart(self):
         """Create score distribution histogram."""
-        scores = [r['evaluation']['score'] for r in self.results]
-        
-        fig = px.histogram(
-            x=scores,
-            nbins=10,
-            title='Score Distribution',
-            labels={'x': 'Score (%)', 'y': 'Number of Tests'},
-            range_x=[0, 100]
-        )
-        
-        # Add pass/fail line
-        fig.add_vline(x=75, line_dash="dash", line_color="red", 
-                     annotation_text="Pass Threshold (75%)")
-        
+        fig = build_score_distribution_chart(self.df['score'].to_numpy())
         st.plotly_chart(fig, use_container_width=True)
     
     def _create_execution_time_chart(self):
         """Create execution time analysis chart."""
-        fig = px.scatter(
-            self.df,
-            x='question_id',
-            y='execution_time',
-            color='category',
-            size=[r['evaluation']['score'] for r in self.results],
-            title='Execution Time by Question',
-            labels={'execution_time': 'Execution Time (s)', 'question_id': 'Question ID'},
-            hover_data=['difficulty', 'question']
+        fig = build_execution_time_chart(
+            self.df[['question_id', 'execution_time', 'category', 'score', 'difficulty', 'question']]
         )
-        
         st.plotly_chart(fig, use_container_width=True)
     
     def _create_detailed_results_table(self):
@@ -206,32 +227,23 @@ class TestResultsAnalyzer:
     
     def _analyze_failed_tests(self):
         """Analyze failed tests to identify patterns."""
-        failed_tests = [r for r in self.results if r['evaluation']['score'] < 75]
+        failed = self.df[self._failed_mask]
         
-        if not failed_tests:
+        if failed.empty:
             st.success("🎉 All tests passed!")
             return
         
-        st.warning(f"Found {len(failed_tests)} failed tests")
-        
-        # Analyze failure patterns
-        failure_by_category = {}
-        failure_by_difficulty = {}
-        common_errors = {}
-        
-        for test in failed_tests:
-            # Category failures
-            cat = test['category']
-            failure_by_category[cat] = failure_by_category.get(cat, 0) + 1
-            
-            # Difficulty failures
-            diff = test['difficulty']
-            failure_by_difficulty[diff] = failure_by_difficulty.get(diff, 0) + 1
-            
-            # Common errors
-            if test['error']:
-                error_type = test['error'].split(':')[0] if ':' in test['error'] else test['error'][:50]
-                common_errors[error_type] = common_errors.get(error_type, 0) + 1
+        st.warning(f"Found {len(failed)} failed tests")
+        
+        # Analyze failure patterns (counts kept in order of first appearance)
+        failure_by_category = failed['category'].value_counts(sort=False).to_dict()
+        failure_by_difficulty = failed['difficulty'].value_counts(sort=False).to_dict()
+        
+        # Common errors: the text before the first ':', or the first 50 characters if there is none
+        errors = failed['error'].dropna()
+        errors = errors[errors.astype(bool)]
+        error_types = errors.str.split(':', n=1).str[0].where(errors.str.contains(':', regex=False), errors.str[:50])
+        common_errors = error_types.value_counts(sort=False).to_dict()
         
         col1, col2 = st.columns(2)
         
@@ -266,7 +278,8 @@ class TestResultsAnalyzer:
         
         # Show worst performing questions
         st.subheader("Lowest Scoring Questions")
-        worst_tests = sorted(failed_tests, key=lambda x: x['evaluation']['score'])[:5]
+        # nsmallest keeps the earlier test on ties, like a stable sort; rows line up with self.results
+        worst_tests = [self.results[i] for i in failed.nsmallest(5, 'score').index]
         
         for test in worst_tests:
             with st.expander(f"Question {test['question_id']}: {test['question'][:60]}... (Score: {test['evaluation']['score']:.1f}%)"):
@@ -294,8 +307,8 @@ class TestResultsAnalyzer:
             return
         
         # Calculate current stats
-        current_pass_rate = sum(1 for r in self.results if r['evaluation']['score'] >= 75) / len(self.results) * 100
-        current_avg_score = sum(r['evaluation']['score'] for r in self.results) / len(self.results)
+        current_pass_rate = (1 - self._failed_mask.mean()) * 100
+        current_avg_score = self.df['score'].mean()
         
         # Calculate baseline stats
         baseline_pass_rate = sum(1 for r in baseline_results if r['evaluation']['score'] >= 75) / len(baseline_results) * 100
@@ -347,8 +360,7 @@ def main():
     
     if uploaded_file is not None:
         try:
-            results_data = json.load(uploaded_file)
-            analyzer = TestResultsAnalyzer(results_data=results_data)
+            analyzer = load_results_analyzer(uploaded_file.getvalue())
             analyzer.create_overview_dashboard()
         except Exception as e:
             st.error(f"Error loading results file: {str(e)}")
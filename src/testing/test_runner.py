@@ -92,7 +92,7 @@ class TestRunner:
                 "success": result["success"],
                 "response": result["response"],
                 "error": result.get("error", None),
-                "has_visualization": result.get("chart_figure") is not None,
+                "has_visualization": result.get("chart_figure_json") is not None,
                 "evaluation": evaluation,
                 "timestamp": datetime.now().isoformat()
             }
@@ -149,7 +149,7 @@ class TestRunner:
         # 3. Expected Output Type (25 points)
         expected_type = question_data["expected_type"]
         if expected_type == "visualization":
-            if result.get("chart_figure") is not None or "fig" in response:
+            if result.get("chart_figure_json") is not None or "fig" in response:
                 criteria["expected_output"] = True
         elif expected_type == "calculation":
             if any(word in response.lower() for word in ["average", "total", "sum", "count", "mean", "median"]):
@@ -168,7 +168,7 @@ class TestRunner:
                 criteria["expected_output"] = True
         
         # 4. Format Compliance (25 points)
-        if "Final Answer:" in response or result.get("chart_figure") is not None:
+        if "Final Answer:" in response or result.get("chart_figure_json") is not None:
             criteria["format_compliance"] = True
         
         # Calculate score
@@ -0,0 +1,40 @@
+"""
+Tests for the large-CSV ingestion path in api.py
+"""
+
+import numpy as np
+import pandas as pd
+
+import api
+
+
+def write_csv_with_missing_strings(path, rows=1_000):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        "id": np.arange(rows),
+        "grp": rng.choice(["a", "b", "c"], rows).astype(object),
+        "name": [f"name{i}" for i in range(rows)],
+    })
+    df.loc[rng.random(rows) < 0.25, "grp"] = None
+    df.loc[rng.random(rows) < 0.15, "name"] = None
+    df.to_csv(path, index=False)
+    # pandas' other missing-value markers, including a quoted empty string
+    with open(path, "a") as f:
+        f.write(f'{rows},NA,null\n{rows + 1},"",N/A\n')
+
+
+def test_read_csv_typed_keeps_missing_strings(tmp_path, monkeypatch):
+    path = tmp_path / "missing.csv"
+    write_csv_with_missing_strings(path)
+    # Route the file through the pyarrow reader instead of the small-file path
+    monkeypatch.setattr(api, "CSV_SAMPLE_ROWS", 100)
+
+    expected = pd.read_csv(path)
+    df = api.read_csv_typed(str(path))
+
+    assert isinstance(df["grp"].dtype, pd.CategoricalDtype)
+    for col in ("grp", "name"):
+        assert df[col].isnull().sum() == expected[col].isnull().sum() > 0
+        assert df[col].isnull().equals(expected[col].isnull())
+        assert df[col].astype(object).value_counts().to_dict() == expected[col].value_counts().to_dict()
+    assert "" not in df["grp"].cat.categories